@@ -21,6 +21,34 @@ class Actions:
         self.openAction.setShortcut("Ctrl+O")
         self.openAction.triggered.connect(app.openFile)
 
+        self.saveAction: QAction = QAction(
+            app.style().standardIcon(QStyle.StandardPixmap.SP_DriveFDIcon), "Save", app
+        )
+        self.saveAction.setShortcut("Ctrl+S")
+        self.saveAction.triggered.connect(app.save)
+
+        self.undoAction: QAction = QAction(
+            app.style().standardIcon(QStyle.StandardPixmap.SP_MediaSkipBackward),
+            "Undo",
+            app,
+        )
+        self.undoAction.setShortcut("Ctrl+Z")
+        self.undoAction.triggered.connect(app.undo)
+
+        self.discardAction: QAction = QAction(
+            app.style().standardIcon(QStyle.StandardPixmap.SP_DialogDiscardButton),
+            "Discard Changes",
+            app,
+        )
+        self.discardAction.triggered.connect(app.discardChanges)
+
+        self.optimizeAction: QAction = QAction(
+            app.style().standardIcon(QStyle.StandardPixmap.SP_BrowserReload),
+            "Optimize...",
+            app,
+        )
+        self.optimizeAction.triggered.connect(app.optimize)
+
         self.relabelAction: QAction = QAction(
             app.style().standardIcon(QStyle.StandardPixmap.SP_LineEditClearButton), "Relabel", app
         )
@@ -72,26 +100,34 @@ class Actions:
         self.quitAction.triggered.connect(QGuiApplication.quit)
 
         self.disableAdfActions()
+        self.updateEditActions(False, None)
 
     def disableAdfActions(self) -> None:
         self.disableFileActions()
 
         self.parentAction.setDisabled(True)
+        self.optimizeAction.setDisabled(True)
         self.relabelAction.setDisabled(True)
         self.makeDirAction.setDisabled(True)
         self.insertAction.setDisabled(True)
 
-    def enableAdfActions(self) -> None:
+    def enableAdfActions(self, readOnly: bool = False) -> None:
         self.parentAction.setDisabled(False)
-        self.relabelAction.setDisabled(False)
-        self.makeDirAction.setDisabled(False)
-        self.insertAction.setDisabled(False)
+        self.optimizeAction.setDisabled(False)
+        self.relabelAction.setDisabled(readOnly)
+        self.makeDirAction.setDisabled(readOnly)
+        self.insertAction.setDisabled(readOnly)
 
     def disableFileActions(self) -> None:
         self.extractAction.setDisabled(True)
         self.deleteAction.setDisabled(True)
 
-    def enableFileActions(self) -> None:
+    def enableFileActions(self, readOnly: bool = False) -> None:
         self.extractAction.setDisabled(False)
-        self.deleteAction.setDisabled(False)
-        self.deleteAction.setDisabled(False)
+        self.deleteAction.setDisabled(readOnly)
+
+    def updateEditActions(self, dirty: bool, undoLabel: str | None) -> None:
+        self.saveAction.setDisabled(not dirty)
+        self.discardAction.setDisabled(not dirty)
+        self.undoAction.setDisabled(undoLabel is None)
+        self.undoAction.setText(f"Undo {undoLabel}" if undoLabel else "Undo")
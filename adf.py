@@ -1,5 +1,9 @@
+import io
 import os.path
-from typing import Dict, List, Optional
+import tempfile
+import zipfile
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 from amitools.fs.ADFSFile import ADFSFile
 from amitools.fs.ADFSVolume import ADFSVolume
@@ -8,14 +12,26 @@ from amitools.fs.FileName import FileName
 from amitools.fs.Imager import Imager
 from amitools.tools.xdftool import make_fsstr
 
+from image_cache import ImageCache, decompressImage, isCompressedImage
+from lha_archive import LhaArchive, isLhaArchive
+from optimizer import Optimizer
+from overlay import Journal, OverlayBlockDevice
+from scanner import classifyBootblock
+
 
 class ADF:
-    def __init__(self, app) -> None:
+    def __init__(self, app, imageCache: Optional[ImageCache] = None) -> None:
         self.app = app
+        self.imageCache = imageCache
+        self.readOnly: bool = False
+        self.imagePath: Optional[str] = None
         self.volume: Optional[ADFSVolume] = None
         self.blkdev = None
         self.node: Optional[ADFSFile] = None
         self.path: Optional[str] = None
+        self.snapshot: Optional[Dict[str, Any]] = None
+        # Archive path -> parsed archive, or None if it could not be parsed
+        self.archives: Dict[str, Optional[LhaArchive]] = {}
 
     def absolutePath(self, name: str) -> str:
         return (self.path + "/" if self.path != "/" else "") + name
@@ -30,27 +46,271 @@ class ADF:
 
         self.volume.create(make_fsstr(name), dos_type=None)
 
-    def open(self, path: str) -> None:
+        # Closing flushes the fresh volume to disk, then reopen it so that
+        # later edits go through the overlay
+        self.cleanUp()
+        self.open(path)
+
+    def open(self, path: str, readOnly: bool = False) -> None:
+        self.attach(path, *self.load(path, readOnly))
+
+    def load(
+        self, path: str, readOnly: bool = False, member: Optional[str] = None
+    ) -> Tuple[Any, ADFSVolume, bool]:
+        """Open an image without touching the current one.
+
+        Safe to call from a worker thread. Returns the block device, the
+        opened volume and whether the image is read-only, ready for attach.
+        If member is given, path is a ZIP archive and member the image in it.
+        """
+        if member:
+            with zipfile.ZipFile(path, "r") as zip_ref:
+                with tempfile.TemporaryDirectory() as temp_dir:
+                    zip_ref.extract(member, temp_dir)
+                    # The extracted copy is temporary, so edits could never
+                    # be saved back
+                    return self.load(os.path.join(temp_dir, member), True)
+
+        if isCompressedImage(path):
+            # Compressed images are unpacked into memory and cannot be
+            # written back, so they are opened read-only
+            if self.imageCache:
+                data = self.imageCache.load(path)
+            else:
+                data = decompressImage(path)
+
+            readOnly = True
+            blkdev = BlkDevFactory().open(
+                os.path.splitext(path)[0] + ".adf",
+                read_only=True,
+                fobj=io.BytesIO(data),
+            )
+        else:
+            # Edits are kept in an overlay until they are saved, so the
+            # image itself is only ever opened for reading
+            if not readOnly:
+                Journal(path).recover()
+            blkdev = OverlayBlockDevice(BlkDevFactory().open(path, read_only=True))
+
+        volume = ADFSVolume(blkdev)
+        volume.open()
+
+        return blkdev, volume, readOnly
+
+    def attach(self, path: str, blkdev, volume: ADFSVolume, readOnly: bool) -> None:
+        self.cleanUp()
+
+        self.imagePath = path
+        self.blkdev = blkdev
+        self.volume = volume
+        self.readOnly = readOnly
+
+    def showSnapshot(self, snapshot: Dict[str, Any]) -> None:
+        """Browse a cached snapshot until the real volume is attached."""
         self.cleanUp()
 
-        self.blkdev = BlkDevFactory().open(path)
+        self.snapshot = snapshot
+        self.path = None
+        self.navigate()
+
+    def buildSnapshot(self, volume: ADFSVolume) -> Dict[str, Any]:
+        tree: Dict[str, List[Dict[str, str]]] = {}
+        pending = [("/", volume.get_root_dir())]
+
+        while pending:
+            path, node = pending.pop()
+            entries = node.get_entries_sorted_by_name()
+            tree[path] = self.listEntries(entries)
+
+            for entry in entries:
+                if entry.is_dir():
+                    name = entry.get_file_name().get_name().__str__()
+                    pending.append(
+                        (name if path == "/" else path + "/" + name, entry)
+                    )
+
+        return {
+            "volumeName": volume.get_volume_name().__str__(),
+            "volumeInfo": volume.get_info().__str__(),
+            "tree": tree,
+        }
+
+    def listEntries(self, entries) -> List[Dict[str, str]]:
+        return [
+            {"name": name, "type": self.entryType(entry, name)}
+            for entry, name in (
+                (entry, entry.get_file_name().get_name().__str__())
+                for entry in entries
+            )
+        ]
+
+    def entryType(self, entry, name: str) -> str:
+        if entry.is_dir():
+            return "dir"
+        return "archive" if isLhaArchive(name) else "file"
+
+    def locateArchive(self, path: str) -> Optional[Tuple[LhaArchive, str]]:
+        """Split a path that leads into an LHA archive on the volume.
+
+        Returns the archive and the path inside it, or None if the path does
+        not pass through an archive. Member tables are cached per archive,
+        and files that fail to parse are treated as plain files.
+        """
+        parts = path.split("/") if path and path != "/" else []
+
+        for i, part in enumerate(parts):
+            if not isLhaArchive(part):
+                continue
+
+            archive_path = "/".join(parts[: i + 1])
+
+            if archive_path not in self.archives:
+                try:
+                    node = self.volume.get_path_name(make_fsstr(archive_path))
+                except Exception:
+                    return None
+
+                if not node or not node.is_file():
+                    continue
+
+                try:
+                    self.archives[archive_path] = LhaArchive(node.get_file_data())
+                except Exception:
+                    self.archives[archive_path] = None
+
+            archive = self.archives[archive_path]
+            if archive is None:
+                continue
+
+            return archive, "/".join(parts[i + 1 :])
+
+        return None
+
+    def isArchive(self, name: str) -> bool:
+        """Whether an entry of the current directory is a browsable archive."""
+        try:
+            located = self.locateArchive(self.absolutePath(name))
+        except Exception:
+            return False
+
+        return located is not None and located[0].isDir(located[1])
+
+    def canWrite(self) -> bool:
+        return (
+            self.volume is not None
+            and not self.readOnly
+            and self.locateArchive(self.path or "/") is None
+        )
+
+    def reopenVolume(self) -> None:
+        # The old volume is dropped without closing it, as closing would
+        # write its stale bitmap back into the overlay
+        self.archives.clear()
         self.volume = ADFSVolume(self.blkdev)
         self.volume.open()
 
+    def refresh(self) -> None:
+        path = self.path or "/"
+        self.path = None
+        self.navigate(path)
+
+        # The current directory may be gone after undo or discard
+        if self.path is None:
+            self.navigate()
+
+    @contextmanager
+    def transaction(self, label: str) -> Iterator[None]:
+        if self.readOnly:
+            raise ValueError("This image is opened read-only.")
+
+        if self.locateArchive(self.path) is not None:
+            raise ValueError("Archives on the volume are read-only.")
+
+        self.blkdev.begin(label)
+        try:
+            yield
+            self.volume.bitmap.write()
+        except BaseException:
+            self.blkdev.rollback()
+            self.reopenVolume()
+            raise
+        self.blkdev.commit()
+        self.archives.clear()
+        self.app.updateEditState()
+
+    def isDirty(self) -> bool:
+        return not self.readOnly and self.blkdev is not None and self.blkdev.isDirty()
+
+    def undoLabel(self) -> Optional[str]:
+        if self.readOnly or self.blkdev is None:
+            return None
+        return self.blkdev.undoLabel()
+
+    def undo(self) -> Optional[str]:
+        label = self.blkdev.undo()
+
+        if label is not None:
+            self.reopenVolume()
+            self.refresh()
+            self.app.updateEditState()
+
+        return label
+
+    def discard(self) -> None:
+        self.blkdev.discard()
+        self.reopenVolume()
+        self.refresh()
+        self.app.updateEditState()
+
+    def save(self) -> None:
+        """Write the dirty blocks back into the image file."""
+        if not self.isDirty():
+            return
+
+        journal = Journal(self.imagePath)
+        journal.write(self.blkdev.dirtyBlocks(), self.blkdev.block_bytes)
+        journal.apply()
+
+        self.open(self.imagePath)
+        self.refresh()
+        self.app.updateEditState()
+
     def navigate(self, path: str = "/") -> None:
+        if not self.volume:
+            if not self.snapshot or path not in self.snapshot["tree"]:
+                return
+
+            self.path = path
+            self.entries = self.snapshot["tree"][path]
+            self.app.updatePath(self.path)
+            self.app.updateBrowser(self.entries)
+            return
+
+        try:
+            located = self.locateArchive(path)
+        except Exception:
+            return
+
+        if located:
+            archive, inner = located
+            if not archive.isDir(inner):
+                return
+
+            self.path = path
+            self.entries = archive.entries(inner)
+            self.app.updatePath(self.path)
+            self.app.updateBrowser(self.entries)
+            return
+
         try:
             self.node = self.volume.get_path_name(make_fsstr(path))
         except:
             return
 
         self.path = path
-        self.entries: List[Dict[str, str]] = [
-            {
-                "name": entry.get_file_name().get_name().__str__(),
-                "type": "dir" if entry.is_dir() else "file",
-            }
-            for entry in self.node.get_entries_sorted_by_name()
-        ]
+        self.entries: List[Dict[str, str]] = self.listEntries(
+            self.node.get_entries_sorted_by_name()
+        )
 
         self.app.updatePath(self.path)
         self.app.updateBrowser(self.entries)
@@ -72,13 +332,29 @@ class ADF:
             self.navigate()
 
     def volumeName(self) -> str:
+        if not self.volume and self.snapshot:
+            return self.snapshot["volumeName"]
         return self.volume.get_volume_name().__str__()
 
     def volumeInfo(self) -> str:
+        if not self.volume and self.snapshot:
+            return self.snapshot["volumeInfo"]
         return self.volume.get_info().__str__()
 
+    def bootblockInfo(self) -> Dict[str, Any]:
+        """Classify the bootblock against the signature database."""
+        data = self.blkdev.read_block(0) + self.blkdev.read_block(1)
+        return classifyBootblock(bytes(data))
+
     def extract(self, name: str, output: str) -> None:
         path = self.absolutePath(name)
+        located = self.locateArchive(self.path)
+
+        if located:
+            archive, inner = located
+            archive.extract(inner + "/" + name if inner else name, output)
+            return
+
         node: ADFSFile = self.volume.get_path_name(make_fsstr(path))
 
         if node.is_file():
@@ -93,37 +369,53 @@ class ADF:
     def insert(self, input: str) -> None:
         name = os.path.basename(input)
 
-        if os.path.isfile(input):
-            fh = open(input, "rb")
-            data = fh.read()
-            fh.close()
+        with self.transaction(f"Insert {name}"):
+            if os.path.isfile(input):
+                fh = open(input, "rb")
+                data = fh.read()
+                fh.close()
 
-            self.volume.write_file(data, make_fsstr(self.path), make_fsstr(name))
-        elif os.path.isdir(input):
-            parent, name = self.volume.get_create_path_name(
-                make_fsstr(self.path), make_fsstr(name)
-            )
+                self.volume.write_file(data, make_fsstr(self.path), make_fsstr(name))
+            elif os.path.isdir(input):
+                parent, name = self.volume.get_create_path_name(
+                    make_fsstr(self.path), make_fsstr(name)
+                )
 
-            node = parent.create_dir(name)
-            img = Imager(meta_mode=Imager.META_MODE_NONE)
-            img.pack_dir(input, node)
+                node = parent.create_dir(name)
+                img = Imager(meta_mode=Imager.META_MODE_NONE)
+                img.pack_dir(input, node)
 
         self.navigate(self.path)
 
     def makeDir(self, name: str) -> None:
         path = self.absolutePath(name)
 
-        self.volume.create_dir(make_fsstr(path))
+        with self.transaction(f"Make Directory {name}"):
+            self.volume.create_dir(make_fsstr(path))
         self.navigate(self.path)
 
     def delete(self, name: str) -> None:
         path = self.absolutePath(name)
 
-        self.volume.delete(make_fsstr(path), all=True)
+        with self.transaction(f"Delete {name}"):
+            self.volume.delete(make_fsstr(path), all=True)
         self.navigate(self.path)
 
     def relabel(self, name: str) -> None:
-        self.volume.relabel(make_fsstr(name))
+        with self.transaction(f"Relabel {name}"):
+            self.volume.relabel(make_fsstr(name))
+
+    def optimize(self, output: str) -> Tuple[float, float]:
+        """Rebuild the volume into a defragmented image at output.
+
+        Returns the fragmentation score before and after.
+        """
+        if self.imagePath and os.path.abspath(output) == os.path.abspath(
+            self.imagePath
+        ):
+            raise ValueError("The optimized image must be written to a new file.")
+
+        return Optimizer(self.volume, self.blkdev).rebuild(output)
 
     def cleanUp(self) -> None:
         if self.volume:
@@ -132,12 +424,24 @@ class ADF:
         if self.blkdev:
             self.blkdev.close()
 
+        self.volume = None
+        self.blkdev = None
+        self.snapshot = None
+        self.archives.clear()
+
     def extractToMemory(self, name: str) -> str:
         """Extract the content of a file as a string."""
         if not self.volume:
             raise ValueError("No volume is currently open.")
 
         path = self.absolutePath(name)
+        located = self.locateArchive(self.path)
+
+        if located:
+            archive, inner = located
+            data = archive.read(inner + "/" + name if inner else name)
+            return data.decode("utf-8", errors="replace")
+
         node = self.volume.get_path_name(make_fsstr(path))
 
         if isinstance(node, ADFSFile) and node.is_file():
@@ -1,11 +1,11 @@
 import os
-import tempfile
 import zipfile
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 
-from PySide6.QtCore import QMimeData, Qt, QSettings
+from PySide6.QtCore import QMimeData, Qt, QSettings, QStandardPaths
 from PySide6.QtGui import QDragEnterEvent, QDropEvent, QCloseEvent
 from PySide6.QtWidgets import (
+    QApplication,
     QFileDialog,
     QInputDialog,
     QMainWindow,
@@ -18,8 +18,11 @@ from PySide6.QtWidgets import (
 from actions import Actions
 from adf import ADF
 from browser import Browser
+from image_cache import COMPRESSED_EXTENSIONS, DEFAULT_MAX_SIZE, ImageCache
+from loader import Loader
 from menu import Menu
 from path import Path
+from snapshot_cache import SnapshotCache
 from status import Status
 from toolbar import Toolbar
 
@@ -32,7 +35,28 @@ class App(QMainWindow):
         self.window_width: int = 640
         self.window_height: int = 512
 
-        self.adf: ADF = ADF(self)
+        self.settings: QSettings = QSettings("ADF Explorer", "ADF Explorer")
+        self.imageCache: ImageCache = ImageCache(
+            os.path.join(
+                QStandardPaths.writableLocation(
+                    QStandardPaths.StandardLocation.CacheLocation
+                ),
+                "images",
+            ),
+            int(self.settings.value("imageCacheSize", DEFAULT_MAX_SIZE)),
+        )
+
+        self.snapshots: SnapshotCache = SnapshotCache(
+            os.path.join(
+                QStandardPaths.writableLocation(
+                    QStandardPaths.StandardLocation.CacheLocation
+                ),
+                "snapshots",
+            )
+        )
+        self.loader: Optional[Loader] = None
+
+        self.adf: ADF = ADF(self, self.imageCache)
 
         self.app_actions: Actions = Actions(self)
         self.toolbar: Toolbar = Toolbar(self)
@@ -40,7 +64,6 @@ class App(QMainWindow):
         self.path: Path = Path(self)
         self.browser: Browser = Browser(self)
         self.status: Status = Status(self)
-        self.settings: QSettings = QSettings("ADF Explorer", "ADF Explorer")
         self.menu.loadRecentFiles()
 
         self.central_widget: QWidget = QWidget(self)
@@ -55,17 +78,28 @@ class App(QMainWindow):
         self.status.setText()
 
     def updateWindowTitle(self) -> None:
-        if self.adf.volume:
-            self.setWindowTitle(self.title + ": " + str(self.adf.volumeName()))
+        if self.adf.volume or self.adf.snapshot:
+            modified = " *" if self.adf.isDirty() else ""
+            self.setWindowTitle(
+                self.title + ": " + str(self.adf.volumeName()) + modified
+            )
         else:
             self.setWindowTitle(self.title)
 
+    def updateEditState(self) -> None:
+        self.app_actions.updateEditActions(self.adf.isDirty(), self.adf.undoLabel())
+        self.updateWindowTitle()
+
     def updatePath(self, path: str) -> None:
         self.path.setText(path)
 
     def updateBrowser(self, entries: List[Dict[str, str]]) -> None:
         self.browser.populate(entries, self.adf.path)
 
+        # Write actions depend on whether the listing is inside an archive
+        if self.adf.volume:
+            self.app_actions.enableAdfActions(not self.adf.canWrite())
+
     def parent(self) -> None:
         self.adf.parent()
         self.browser.deselect()
@@ -79,7 +113,10 @@ class App(QMainWindow):
         self.browser.deselect()
 
     def enableFileActions(self) -> None:
-        self.app_actions.enableFileActions()
+        if not self.adf.volume:
+            return
+
+        self.app_actions.enableFileActions(not self.adf.canWrite())
 
     def disableFileActions(self) -> None:
         self.app_actions.disableFileActions()
@@ -117,6 +154,72 @@ class App(QMainWindow):
         if result == QMessageBox.StandardButton.Yes:
             self.adf.delete(selected_item)
 
+    def save(self) -> None:
+        try:
+            self.adf.save()
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"Failed to save changes: {e}")
+
+    def undo(self) -> None:
+        self.adf.undo()
+        self.browser.deselect()
+
+    def discardChanges(self) -> None:
+        result = QMessageBox.question(
+            self,
+            "Discard Changes",
+            "Discard all unsaved changes to this image?",
+        )
+
+        if result == QMessageBox.StandardButton.Yes:
+            self.adf.discard()
+            self.browser.deselect()
+
+    def maybeSave(self) -> bool:
+        """Ask what to do with unsaved changes. Returns False to cancel."""
+        if not self.adf.isDirty():
+            return True
+
+        result = QMessageBox.question(
+            self,
+            "Unsaved Changes",
+            "The image has unsaved changes. Save them?",
+            QMessageBox.StandardButton.Save
+            | QMessageBox.StandardButton.Discard
+            | QMessageBox.StandardButton.Cancel,
+        )
+
+        if result == QMessageBox.StandardButton.Save:
+            self.save()
+            return not self.adf.isDirty()
+
+        return result == QMessageBox.StandardButton.Discard
+
+    def optimize(self) -> None:
+        path, _ = QFileDialog.getSaveFileName(
+            self, "Save Optimized Image", "", "ADF Files (*.adf);;All Files (*)"
+        )
+
+        if not path:
+            return
+
+        QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
+        try:
+            before, after = self.adf.optimize(path)
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"Failed to optimize image: {e}")
+            return
+        finally:
+            QApplication.restoreOverrideCursor()
+
+        QMessageBox.information(
+            self,
+            "Optimize",
+            f"Optimized image written to {path}.\n\n"
+            f"Fragmentation before: {before:.1f}%\n"
+            f"Fragmentation after: {after:.1f}%",
+        )
+
     def extract(self) -> None:
         selected_item = self.browser.selectedItem()
         if not selected_item:
@@ -138,6 +241,9 @@ class App(QMainWindow):
                 self.adf.insert(selected_files[0])
 
     def createAdf(self) -> None:
+        if not self.maybeSave():
+            return
+
         path, _ = QFileDialog.getSaveFileName(
             self,
             "Create ADF File",
@@ -146,35 +252,136 @@ class App(QMainWindow):
         )
 
         if path:
+            # Drop an open still loading in the background, so it does not
+            # replace the new image once it finishes
+            self.loader = None
             self.adf.create(path)  # Type: ignore
+            self.updateEditState()
 
     def openFile(self, path: Optional[str] = None) -> None:
+        if not self.maybeSave():
+            return
+
         if not path:
             path, _ = QFileDialog.getOpenFileName(
                 self,
                 "Open ADF or ZIP File",
                 "",
-                "ADF and ZIP Files (*.adf *.zip);;All Files (*)",
+                "ADF, ADZ, DMS and ZIP Files (*.adf *.adz *.dms *.zip);;All Files (*)",
             )
 
-        if path:
-            try:
-                if path.lower().endswith(".zip"):
-                    self.openZipAdf(path)
-                else:
-                    self.adf.open(path)
-                    self.startBrowsing()
+        if not path:
+            return
+
+        snapshot = self.snapshots.load(path)
+        member = None
+
+        if path.lower().endswith(".zip"):
+            member = snapshot.get("member") if snapshot else None
+            if not member:
+                member = self.selectZipMember(path)
+            if not member:
+                return
+
+        self.app_actions.disableAdfActions()
+        self.updateEditState()
+        # The verdict belongs to the previous image until the new one loads
+        self.status.setBootblock(None)
+
+        # Show the cached directory tree right away while the real volume
+        # is opened in the background
+        if snapshot:
+            self.adf.showSnapshot(snapshot)
+            self.status.setText(self.adf.volumeInfo())
+            self.updateWindowTitle()
+        else:
+            self.adf.cleanUp()
+            self.browser.populate([])
+            self.path.disable()
+            self.status.setText(f"Opening {os.path.basename(path)}...")
+            self.updateWindowTitle()
+
+        loader = Loader(lambda: self.loadImage(path, member), self)
+        loader.loaded.connect(
+            lambda result: self.imageLoaded(loader, path, result)
+        )
+        loader.failed.connect(lambda error: self.imageFailed(loader, error))
+        loader.finished.connect(loader.deleteLater)
+        self.loader = loader
+        loader.start()
+
+    def loadImage(self, path: str, member: Optional[str]) -> Tuple:
+        blkdev, volume, readOnly = self.adf.load(path, member=member)
+        snapshot = self.adf.buildSnapshot(volume)
+
+        if member:
+            snapshot["member"] = member
+        self.snapshots.save(path, snapshot)
 
-                self.menu.updateRecentFiles([path])
-            except Exception as e:
-                QMessageBox.critical(self, "Error", f"Failed to open file: {e}")
+        return blkdev, volume, readOnly, snapshot
+
+    def imageLoaded(self, loader: Loader, path: str, result: Tuple) -> None:
+        blkdev, volume, readOnly, snapshot = result
+
+        if loader is not self.loader:
+            # Superseded by a newer open
+            volume.close()
+            blkdev.close()
+            return
+
+        self.loader = None
+        shown = self.adf.snapshot
+        self.adf.attach(path, blkdev, volume, readOnly)
+        self.menu.updateRecentFiles([path])
+
+        if shown is None:
+            self.startBrowsing()
+            return
+
+        # Keep the listing taken from the snapshot unless the real volume
+        # turned out to differ from it
+        self.startBrowsing(None)
+
+        if any(
+            shown.get(key) != snapshot[key]
+            for key in ("volumeName", "volumeInfo", "tree")
+        ):
+            self.adf.refresh()
+            self.browser.deselect()
+        elif self.browser.selectedItem():
+            self.enableFileActions()
+
+    def imageFailed(self, loader: Loader, error: str) -> None:
+        if loader is not self.loader:
+            return
 
-    def startBrowsing(self, path: str = "/") -> None:
-        self.app_actions.enableAdfActions()
+        self.loader = None
+        self.adf.cleanUp()
+        self.browser.populate([])
+        self.path.disable()
+        self.status.setText("No file open")
+        self.status.setBootblock(None)
+        self.updateWindowTitle()
+        QMessageBox.critical(self, "Error", f"Failed to open file: {error}")
+
+    def startBrowsing(self, path: Optional[str] = "/") -> None:
+        self.app_actions.enableAdfActions(not self.adf.canWrite())
         self.status.setText(self.adf.volumeInfo())
+        self.showBootblockInfo()
         self.path.enable()
-        self.updateWindowTitle()
-        self.navigate(path)
+        self.updateEditState()
+
+        if path is not None:
+            self.navigate(path)
+
+    def showBootblockInfo(self) -> None:
+        try:
+            info = self.adf.bootblockInfo()
+        except Exception:
+            # A missing or broken signature database must not block opening
+            info = None
+
+        self.status.setBootblock(info)
 
     def initUI(self) -> None:
         self.resize(self.window_width, self.window_height)
@@ -208,48 +415,58 @@ class App(QMainWindow):
         if mime_data.hasUrls():
             for url in mime_data.urls():
                 file_path = url.toLocalFile()
-                if file_path.endswith(".adf") or file_path.endswith(".zip"):
+                if file_path.lower().endswith(
+                    (".adf", ".zip") + COMPRESSED_EXTENSIONS
+                ):
                     self.openFile(file_path)
                 else:
                     QMessageBox.warning(
-                        self, "Invalid File", "Only ADF and ZIP files are supported."
+                        self,
+                        "Invalid File",
+                        "Only ADF, ADZ, DMS and ZIP files are supported.",
                     )
 
-    def openZipAdf(self, zip_path: str) -> None:
+    def selectZipMember(self, zip_path: str) -> Optional[str]:
         try:
             with zipfile.ZipFile(zip_path, "r") as zip_ref:
                 adf_files = [
-                    name for name in zip_ref.namelist() if name.lower().endswith(".adf")
+                    name
+                    for name in zip_ref.namelist()
+                    if name.lower().endswith((".adf",) + COMPRESSED_EXTENSIONS)
                 ]
-                if not adf_files:
-                    QMessageBox.critical(
-                        self, "Error", "No ADF file found in the ZIP archive."
-                    )
-                    return
-                if len(adf_files) > 1:
-                    selected_file, ok = QInputDialog.getItem(
-                        self,
-                        "Select ADF File",
-                        "Multiple ADF files found. Please select one:",
-                        adf_files,
-                    )
-                    if not ok or not selected_file:
-                        return
-                else:
-                    selected_file = adf_files[0]
-                with tempfile.TemporaryDirectory() as temp_dir:
-                    temp_path = os.path.join(temp_dir, selected_file)
-                    zip_ref.extract(selected_file, temp_dir)
-                    self.adf.open(temp_path)
-                    self.startBrowsing()
         except zipfile.BadZipFile:
             QMessageBox.critical(
                 self, "Error", "The selected file is not a valid ZIP archive."
             )
+            return None
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Failed to open ZIP file: {e}")
+            return None
+
+        if not adf_files:
+            QMessageBox.critical(self, "Error", "No ADF file found in the ZIP archive.")
+            return None
+        if len(adf_files) > 1:
+            selected_file, ok = QInputDialog.getItem(
+                self,
+                "Select ADF File",
+                "Multiple ADF files found. Please select one:",
+                adf_files,
+            )
+            if not ok or not selected_file:
+                return None
+            return selected_file
+
+        return adf_files[0]
 
     def closeEvent(self, event: QCloseEvent) -> None:
+        if not self.maybeSave():
+            event.ignore()
+            return
+
+        if self.loader:
+            self.loader.wait()
+
         self.menu.saveRecentFiles()
         self.cleanUp()
         event.accept()
@@ -56,11 +56,14 @@ class Browser:
 
         sorted_entries = sorted(entries, key=lambda e: 0 if e["type"] == "dir" else 1)
 
+        icons = {
+            "dir": QStyle.StandardPixmap.SP_DirIcon,
+            "archive": QStyle.StandardPixmap.SP_DirLinkIcon,
+        }
+
         for entry in sorted_entries:
             icon = self.app.style().standardIcon(
-                QStyle.StandardPixmap.SP_FileIcon
-                if entry["type"] == "file"
-                else QStyle.StandardPixmap.SP_DirIcon
+                icons.get(entry["type"], QStyle.StandardPixmap.SP_FileIcon)
             )
             item: QStandardItem = QStandardItem(icon, entry["name"])
             item.setData(entry)
@@ -71,9 +74,12 @@ class Browser:
             data = self.item.data()
             if data["type"] == "parent":
                 self.app.parent()
-            elif data["type"] == "dir":
+            elif data["type"] == "dir" or (
+                data["type"] == "archive"
+                and self.app.adf.isArchive(self.selectedItem())
+            ):
                 self.app.navigateDown(self.selectedItem())
-            else:
+            elif self.app.adf.volume:
                 file_name: str = self.selectedItem()
                 file_content: str = self.app.adf.extractToMemory(file_name)
                 viewer = ContentViewer(self.app, file_name, file_content)
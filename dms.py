@@ -0,0 +1,614 @@
+import struct
+from typing import BinaryIO, Iterator, List
+
+HEADER_SIZE = 56
+TRACK_HEADER_SIZE = 20
+TEXT_SIZE = 0x4000
+
+QUICK_MASK = 0xFF
+MEDIUM_MASK = 0x3FFF
+DEEP_MASK = 0x3FFF
+
+# Static position tables shared by the Medium and Deep decrunchers
+D_CODE: List[int] = (
+    [0x00] * 32
+    + [c for c in range(0x01, 0x04) for _ in range(16)]
+    + [c for c in range(0x04, 0x0C) for _ in range(8)]
+    + [c for c in range(0x0C, 0x18) for _ in range(4)]
+    + [c for c in range(0x18, 0x30) for _ in range(2)]
+    + list(range(0x30, 0x40))
+)
+D_LEN: List[int] = [3] * 32 + [4] * 48 + [5] * 64 + [6] * 48 + [7] * 48 + [8] * 16
+
+# Deep (adaptive Huffman) parameters
+DEEP_F = 60
+DEEP_THRESHOLD = 2
+DEEP_N_CHAR = 256 - DEEP_THRESHOLD + DEEP_F
+DEEP_T = DEEP_N_CHAR * 2 - 1
+DEEP_R = DEEP_T - 1
+DEEP_MAX_FREQ = 0x8000
+
+# Heavy (static Huffman) parameters
+HEAVY_NC = 510
+HEAVY_NPT = 20
+HEAVY_OFFSET = 253
+
+
+def _crcTable() -> List[int]:
+    table = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+CRC_TABLE = _crcTable()
+
+
+def crc16(data: bytes) -> int:
+    crc = 0
+    for b in data:
+        crc = CRC_TABLE[(crc ^ b) & 0xFF] ^ (crc >> 8)
+    return crc
+
+
+class DMSError(Exception):
+    pass
+
+
+class BitReader:
+    def __init__(self, data: bytes) -> None:
+        self.data = data
+        self.pos = 0
+        self.bitbuf = 0
+        self.bitcount = 0
+        self.dropBits(0)
+
+    def getBits(self, n: int) -> int:
+        return (self.bitbuf >> (self.bitcount - n)) & ((1 << n) - 1)
+
+    def dropBits(self, n: int) -> None:
+        self.bitcount -= n
+        self.bitbuf &= (1 << self.bitcount) - 1
+        while self.bitcount < 16:
+            byte = self.data[self.pos] if self.pos < len(self.data) else 0
+            self.pos += 1
+            self.bitbuf = (self.bitbuf << 8) | byte
+            self.bitcount += 8
+
+
+class DMS:
+    """Decompressor for DiskMasher (DMS) images, ported from xDMS.
+
+    Tracks are decoded one at a time from a file object, so an image can be
+    unpacked without holding the compressed archive in memory.
+    """
+
+    def __init__(self) -> None:
+        self.text = bytearray(TEXT_SIZE)
+        self.initDecrunchers()
+
+        # Heavy decoder tables survive between tracks unless a track header
+        # asks for new ones, and are not reset by initDecrunchers
+        self.cLen = [0] * HEAVY_NC
+        self.ptLen = [0] * HEAVY_NPT
+        self.cTable = [0] * 4096
+        self.ptTable = [0] * 256
+        self.left = [0] * (2 * HEAVY_NC - 1)
+        self.right = [0] * (2 * HEAVY_NC - 1 + 9)
+        self.lastLen = 0
+        self.np = 0
+
+    def initDecrunchers(self) -> None:
+        self.quickLoc = 251
+        self.mediumLoc = 0x3FBE
+        self.heavyLoc = 0
+        self.deepLoc = 0x3FC4
+        self.deepTabsReady = False
+        self.text[:0x3FC8] = bytes(0x3FC8)
+
+    def tracks(self, fh: BinaryIO) -> Iterator[bytes]:
+        """Yield the unpacked data of every disk track in the archive."""
+        header = fh.read(HEADER_SIZE)
+
+        if len(header) < HEADER_SIZE or header[:4] != b"DMS!":
+            raise DMSError("Not a DMS archive.")
+
+        if struct.unpack(">H", header[54:56])[0] != crc16(header[4:54]):
+            raise DMSError("DMS header is corrupt.")
+
+        geninfo = struct.unpack(">H", header[10:12])[0]
+
+        if geninfo & 2:
+            raise DMSError("Encrypted DMS archives are not supported.")
+
+        while True:
+            trackHeader = fh.read(TRACK_HEADER_SIZE)
+
+            if len(trackHeader) < TRACK_HEADER_SIZE or trackHeader[:2] != b"TR":
+                return
+
+            (
+                number,
+                pklen1,
+                pklen2,
+                unpklen,
+                flags,
+                cmode,
+                usum,
+                dcrc,
+                hcrc,
+            ) = struct.unpack(">2xH2xHHHBBHHH", trackHeader)
+
+            if hcrc != crc16(trackHeader[:18]):
+                raise DMSError(f"Track {number} header is corrupt.")
+
+            packed = fh.read(pklen1)
+
+            if len(packed) < pklen1 or dcrc != crc16(packed):
+                raise DMSError(f"Track {number} data is corrupt.")
+
+            # Track 80 carries FILEID.DIZ, 0xffff the banner and a short track
+            # 0 a fake bootblock. Like xDMS, only real disk tracks are
+            # decrunched, so the others never touch the decruncher state
+            if number >= 80 or unpklen <= 2048:
+                continue
+
+            data = self.unpackTrack(packed, pklen2, unpklen, cmode, flags)
+
+            if usum != sum(data) & 0xFFFF:
+                raise DMSError(f"Track {number} checksum mismatch.")
+            yield data
+
+    def unpack(self, fh: BinaryIO) -> bytes:
+        return b"".join(self.tracks(fh))
+
+    def unpackTrack(
+        self, packed: bytes, pklen2: int, unpklen: int, cmode: int, flags: int
+    ) -> bytes:
+        try:
+            data = self.decrunch(packed, pklen2, unpklen, cmode, flags)
+        except IndexError:
+            raise DMSError("Track data ends unexpectedly.")
+
+        if not flags & 1:
+            self.initDecrunchers()
+
+        return bytes(data[:unpklen])
+
+    def decrunch(
+        self, packed: bytes, pklen2: int, unpklen: int, cmode: int, flags: int
+    ) -> bytes:
+        if cmode == 0:
+            data = packed[:unpklen]
+        elif cmode == 1:
+            data = self.unpackRle(packed, unpklen)
+        elif cmode == 2:
+            data = self.unpackRle(self.unpackQuick(packed, pklen2), unpklen)
+        elif cmode == 3:
+            data = self.unpackRle(self.unpackMedium(packed, pklen2), unpklen)
+        elif cmode == 4:
+            data = self.unpackRle(self.unpackDeep(packed, pklen2), unpklen)
+        elif cmode in (5, 6):
+            heavyFlags = flags & 7 if cmode == 5 else flags | 8
+            data = self.unpackHeavy(packed, heavyFlags, pklen2)
+            if flags & 4:
+                data = self.unpackRle(data, unpklen)
+        else:
+            raise DMSError(f"Unknown DMS compression mode {cmode}.")
+
+        return data
+
+    def unpackRle(self, data: bytes, size: int) -> bytearray:
+        out = bytearray()
+        pos = 0
+
+        while len(out) < size:
+            a = data[pos]
+            pos += 1
+            if a != 0x90:
+                out.append(a)
+                continue
+
+            b = data[pos]
+            pos += 1
+            if b == 0:
+                out.append(a)
+                continue
+
+            a = data[pos]
+            pos += 1
+            if b == 0xFF:
+                n = (data[pos] << 8) | data[pos + 1]
+                pos += 2
+            else:
+                n = b
+
+            if len(out) + n > size:
+                raise DMSError("RLE data overruns track.")
+            out += bytes([a]) * n
+
+        return out
+
+    def unpackQuick(self, data: bytes, size: int) -> bytearray:
+        bits = BitReader(data)
+        text = self.text
+        loc = self.quickLoc
+        out = bytearray()
+
+        while len(out) < size:
+            if bits.getBits(1):
+                bits.dropBits(1)
+                c = bits.getBits(8)
+                bits.dropBits(8)
+                text[loc & QUICK_MASK] = c
+                loc += 1
+                out.append(c)
+            else:
+                bits.dropBits(1)
+                j = bits.getBits(2) + 2
+                bits.dropBits(2)
+                i = loc - bits.getBits(8) - 1
+                bits.dropBits(8)
+                for _ in range(j):
+                    c = text[i & QUICK_MASK]
+                    text[loc & QUICK_MASK] = c
+                    loc += 1
+                    i += 1
+                    out.append(c)
+
+        self.quickLoc = (loc + 5) & QUICK_MASK
+        return out
+
+    def decodePosition(self, bits: BitReader) -> int:
+        i = bits.getBits(8)
+        bits.dropBits(8)
+        c = D_CODE[i] << 8
+        j = D_LEN[i]
+        i = ((i << j) | bits.getBits(j)) & 0xFF
+        bits.dropBits(j)
+        return c | i
+
+    def unpackMedium(self, data: bytes, size: int) -> bytearray:
+        bits = BitReader(data)
+        text = self.text
+        loc = self.mediumLoc
+        out = bytearray()
+
+        while len(out) < size:
+            if bits.getBits(1):
+                bits.dropBits(1)
+                c = bits.getBits(8)
+                bits.dropBits(8)
+                text[loc & MEDIUM_MASK] = c
+                loc += 1
+                out.append(c)
+            else:
+                bits.dropBits(1)
+                c = bits.getBits(8)
+                bits.dropBits(8)
+                j = D_CODE[c] + 3
+                u = D_LEN[c]
+                c = ((c << u) | bits.getBits(u)) & 0xFF
+                bits.dropBits(u)
+                u = D_LEN[c]
+                c = (D_CODE[c] << 8) | (((c << u) | bits.getBits(u)) & 0xFF)
+                bits.dropBits(u)
+                i = loc - c - 1
+                for _ in range(j):
+                    c = text[i & MEDIUM_MASK]
+                    text[loc & MEDIUM_MASK] = c
+                    loc += 1
+                    i += 1
+                    out.append(c)
+
+        self.mediumLoc = (loc + 66) & MEDIUM_MASK
+        return out
+
+    def initDeepTabs(self) -> None:
+        self.freq = [0] * (DEEP_T + 1)
+        self.prnt = [0] * (DEEP_T + DEEP_N_CHAR)
+        self.son = [0] * DEEP_T
+
+        for i in range(DEEP_N_CHAR):
+            self.freq[i] = 1
+            self.son[i] = i + DEEP_T
+            self.prnt[i + DEEP_T] = i
+
+        i = 0
+        j = DEEP_N_CHAR
+        while j <= DEEP_R:
+            self.freq[j] = self.freq[i] + self.freq[i + 1]
+            self.son[j] = i
+            self.prnt[i] = self.prnt[i + 1] = j
+            i += 2
+            j += 1
+
+        self.freq[DEEP_T] = 0xFFFF
+        self.prnt[DEEP_R] = 0
+        self.deepTabsReady = True
+
+    def deepReconst(self) -> None:
+        freq, son, prnt = self.freq, self.son, self.prnt
+
+        j = 0
+        for i in range(DEEP_T):
+            if son[i] >= DEEP_T:
+                freq[j] = (freq[i] + 1) // 2
+                son[j] = son[i]
+                j += 1
+
+        i = 0
+        for j in range(DEEP_N_CHAR, DEEP_T):
+            f = freq[i] + freq[i + 1]
+            freq[j] = f
+            k = j - 1
+            while f < freq[k]:
+                k -= 1
+            k += 1
+            freq[k + 1 : j + 1] = freq[k:j]
+            freq[k] = f
+            son[k + 1 : j + 1] = son[k:j]
+            son[k] = i
+            i += 2
+
+        for i in range(DEEP_T):
+            k = son[i]
+            if k >= DEEP_T:
+                prnt[k] = i
+            else:
+                prnt[k] = prnt[k + 1] = i
+
+    def deepUpdate(self, c: int) -> None:
+        if self.freq[DEEP_R] == DEEP_MAX_FREQ:
+            self.deepReconst()
+
+        freq, son, prnt = self.freq, self.son, self.prnt
+
+        c = prnt[c + DEEP_T]
+        while True:
+            freq[c] += 1
+            k = freq[c]
+
+            # If the order is disturbed, exchange nodes
+            l = c + 1
+            if k > freq[l]:
+                l += 1
+                while k > freq[l]:
+                    l += 1
+                l -= 1
+                freq[c] = freq[l]
+                freq[l] = k
+
+                i = son[c]
+                prnt[i] = l
+                if i < DEEP_T:
+                    prnt[i + 1] = l
+
+                j = son[l]
+                son[l] = i
+
+                prnt[j] = c
+                if j < DEEP_T:
+                    prnt[j + 1] = c
+                son[c] = j
+
+                c = l
+
+            c = prnt[c]
+            if c == 0:
+                break
+
+    def unpackDeep(self, data: bytes, size: int) -> bytearray:
+        bits = BitReader(data)
+
+        if not self.deepTabsReady:
+            self.initDeepTabs()
+
+        text = self.text
+        son = self.son
+        loc = self.deepLoc
+        out = bytearray()
+
+        while len(out) < size:
+            c = son[DEEP_R]
+            while c < DEEP_T:
+                c = son[c + bits.getBits(1)]
+                bits.dropBits(1)
+            c -= DEEP_T
+            self.deepUpdate(c)
+
+            if c < 256:
+                text[loc & DEEP_MASK] = c
+                loc += 1
+                out.append(c)
+            else:
+                j = c - 255 + DEEP_THRESHOLD
+                i = loc - self.decodePosition(bits) - 1
+                for _ in range(j):
+                    c = text[i & DEEP_MASK]
+                    text[loc & DEEP_MASK] = c
+                    loc += 1
+                    i += 1
+                    out.append(c)
+
+        self.deepLoc = (loc + 60) & DEEP_MASK
+        return out
+
+    def makeTable(
+        self, nchar: int, bitlen: List[int], tablebits: int, table: List[int]
+    ) -> None:
+        tblsiz = 1 << tablebits
+        maxdepth = tablebits + 1
+        left, right = self.left, self.right
+        state = {
+            "c": -1,
+            "len": 1,
+            "depth": 1,
+            "bit": tblsiz // 2,
+            "codeword": 0,
+            "avail": nchar,
+        }
+
+        def mktbl() -> int:
+            i = 0
+
+            if state["len"] == state["depth"]:
+                state["c"] += 1
+                while state["c"] < nchar:
+                    c = state["c"]
+                    if bitlen[c] == state["len"]:
+                        i = state["codeword"]
+                        state["codeword"] += state["bit"]
+                        if state["codeword"] > tblsiz:
+                            raise DMSError("Bad Huffman table.")
+                        table[i : state["codeword"]] = [c] * (state["codeword"] - i)
+                        return c
+                    state["c"] += 1
+                state["c"] = -1
+                state["len"] += 1
+                state["bit"] >>= 1
+
+            state["depth"] += 1
+            if state["depth"] < maxdepth:
+                mktbl()
+                mktbl()
+            elif state["depth"] > 32:
+                raise DMSError("Bad Huffman table.")
+            else:
+                i = state["avail"]
+                state["avail"] += 1
+                if i >= 2 * nchar - 1:
+                    raise DMSError("Bad Huffman table.")
+                left[i] = mktbl()
+                right[i] = mktbl()
+                if state["codeword"] >= tblsiz:
+                    raise DMSError("Bad Huffman table.")
+                if state["depth"] == maxdepth:
+                    table[state["codeword"]] = i
+                    state["codeword"] += 1
+            state["depth"] -= 1
+            return i
+
+        mktbl()
+        mktbl()
+
+        if state["codeword"] != tblsiz:
+            raise DMSError("Bad Huffman table.")
+
+    def readTreeC(self, bits: BitReader) -> None:
+        n = bits.getBits(9)
+        bits.dropBits(9)
+
+        if n > 0:
+            for i in range(n):
+                self.cLen[i] = bits.getBits(5)
+                bits.dropBits(5)
+            for i in range(n, HEAVY_NC):
+                self.cLen[i] = 0
+            self.makeTable(HEAVY_NC, self.cLen, 12, self.cTable)
+        else:
+            n = bits.getBits(9)
+            bits.dropBits(9)
+            self.cLen[:] = [0] * HEAVY_NC
+            self.cTable[:] = [n] * 4096
+
+    def readTreeP(self, bits: BitReader) -> None:
+        n = bits.getBits(5)
+        bits.dropBits(5)
+
+        if n > 0:
+            for i in range(n):
+                self.ptLen[i] = bits.getBits(4)
+                bits.dropBits(4)
+            for i in range(n, self.np):
+                self.ptLen[i] = 0
+            self.makeTable(self.np, self.ptLen, 8, self.ptTable)
+        else:
+            n = bits.getBits(5)
+            bits.dropBits(5)
+            self.ptLen[: self.np] = [0] * self.np
+            self.ptTable[:] = [n] * 256
+
+    def decodeC(self, bits: BitReader) -> int:
+        j = self.cTable[bits.getBits(12)]
+
+        if j < HEAVY_NC:
+            bits.dropBits(self.cLen[j])
+        else:
+            bits.dropBits(12)
+            i = bits.getBits(16)
+            m = 0x8000
+            while True:
+                j = self.right[j] if i & m else self.left[j]
+                m >>= 1
+                if j < HEAVY_NC:
+                    break
+            bits.dropBits(self.cLen[j] - 12)
+
+        return j
+
+    def decodeP(self, bits: BitReader) -> int:
+        j = self.ptTable[bits.getBits(8)]
+
+        if j < self.np:
+            bits.dropBits(self.ptLen[j])
+        else:
+            bits.dropBits(8)
+            i = bits.getBits(16)
+            m = 0x8000
+            while True:
+                j = self.right[j] if i & m else self.left[j]
+                m >>= 1
+                if j < self.np:
+                    break
+            bits.dropBits(self.ptLen[j] - 8)
+
+        if j != self.np - 1:
+            if j > 0:
+                i = j - 1
+                j = bits.getBits(i) | (1 << i)
+                bits.dropBits(i)
+            self.lastLen = j
+
+        return self.lastLen
+
+    def unpackHeavy(self, data: bytes, flags: int, size: int) -> bytearray:
+        # Heavy 1 uses a 4Kb dictionary, Heavy 2 uses 8Kb
+        if flags & 8:
+            self.np = 15
+            mask = 0x1FFF
+        else:
+            self.np = 14
+            mask = 0x0FFF
+
+        bits = BitReader(data)
+
+        if flags & 2:
+            self.readTreeC(bits)
+            self.readTreeP(bits)
+
+        text = self.text
+        loc = self.heavyLoc
+        out = bytearray()
+
+        while len(out) < size:
+            c = self.decodeC(bits)
+            if c < 256:
+                text[loc & mask] = c
+                loc += 1
+                out.append(c)
+            else:
+                j = c - HEAVY_OFFSET
+                i = loc - self.decodeP(bits) - 1
+                for _ in range(j):
+                    c = text[i & mask]
+                    text[loc & mask] = c
+                    loc += 1
+                    i += 1
+                    out.append(c)
+
+        self.heavyLoc = loc & 0xFFFF
+        return out
@@ -0,0 +1,137 @@
+import gzip
+import hashlib
+import os
+import tempfile
+from typing import List, Optional
+
+from dms import DMS
+
+ADZ_EXTENSIONS = (".adz", ".adf.gz")
+DMS_EXTENSIONS = (".dms",)
+COMPRESSED_EXTENSIONS = ADZ_EXTENSIONS + DMS_EXTENSIONS
+
+CHUNK_SIZE = 64 * 1024
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+
+
+def fileHash(path: str) -> str:
+    digest = hashlib.sha256()
+
+    with open(path, "rb") as fh:
+        while chunk := fh.read(CHUNK_SIZE):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def isCompressedImage(path: str) -> bool:
+    return path.lower().endswith(COMPRESSED_EXTENSIONS)
+
+
+def decompressImage(path: str) -> bytes:
+    """Unpack an ADZ or DMS file into a raw disk image."""
+    data = bytearray()
+
+    if path.lower().endswith(DMS_EXTENSIONS):
+        with open(path, "rb") as fh:
+            for track in DMS().tracks(fh):
+                data += track
+    else:
+        with gzip.open(path, "rb") as fh:
+            while chunk := fh.read(CHUNK_SIZE):
+                data += chunk
+
+    return bytes(data)
+
+
+class ImageCache:
+    """On-disk LRU cache of decompressed images, keyed by content hash.
+
+    The modification time of a cached image doubles as its last access time,
+    so the least recently used images are evicted first once the cache grows
+    past its size limit.
+    """
+
+    def __init__(self, directory: str, maxSize: int = DEFAULT_MAX_SIZE) -> None:
+        self.directory = directory
+        self.maxSize = maxSize
+
+    def key(self, path: str) -> str:
+        return fileHash(path)
+
+    def entryPath(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".adf")
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self.entryPath(key)
+
+        try:
+            with open(path, "rb") as fh:
+                data = fh.read()
+            os.utime(path)
+        except OSError:
+            return None
+
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        if len(data) > self.maxSize:
+            return
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                fh.write(data)
+            os.replace(temp_path, self.entryPath(key))
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+
+        self.evict()
+
+    def entries(self) -> List[os.DirEntry]:
+        try:
+            return [
+                entry
+                for entry in os.scandir(self.directory)
+                if entry.is_file() and entry.name.endswith(".adf")
+            ]
+        except OSError:
+            return []
+
+    def evict(self) -> None:
+        stats = sorted(
+            ((entry.path, entry.stat()) for entry in self.entries()),
+            key=lambda item: item[1].st_mtime,
+        )
+        total = sum(stat.st_size for _, stat in stats)
+
+        for path, stat in stats:
+            if total <= self.maxSize:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= stat.st_size
+
+    def clear(self) -> None:
+        for entry in self.entries():
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+    def load(self, path: str) -> bytes:
+        """Return the decompressed image for path, unpacking it on a miss."""
+        key = self.key(path)
+        data = self.get(key)
+
+        if data is None:
+            data = decompressImage(path)
+            self.put(key, data)
+
+        return data
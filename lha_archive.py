@@ -0,0 +1,89 @@
+import io
+import os
+from typing import Dict, List
+
+import lhafile
+
+LHA_EXTENSIONS = (".lha", ".lzh")
+
+
+def isLhaArchive(name: str) -> bool:
+    return name.lower().endswith(LHA_EXTENSIONS)
+
+
+class LhaArchive:
+    """Read-only view of an LHA archive held in memory.
+
+    Only the member table is parsed up front. Members are decompressed on
+    demand when they are read or extracted.
+    """
+
+    def __init__(self, data: bytes) -> None:
+        self.lha = lhafile.LhaFile(io.BytesIO(data))
+        # Normalized member path -> name as known to lhafile
+        self.members: Dict[str, str] = {}
+        # Directory path -> {entry name: entry type}
+        self.dirs: Dict[str, Dict[str, str]] = {"": {}}
+
+        for info in self.lha.infolist():
+            path = self.normalize(info.filename)
+            if not path:
+                continue
+
+            compress_type = info.compress_type
+            if isinstance(compress_type, bytes):
+                compress_type = compress_type.decode("ascii", errors="replace")
+
+            if compress_type == "-lhd-":
+                self.addDir(path)
+            else:
+                self.addParents(path, "file")
+                self.members[path] = info.filename
+
+    def normalize(self, name: str) -> str:
+        name = name.replace("\\", "/").replace(os.sep, "/")
+        return "/".join(part for part in name.split("/") if part not in ("", "."))
+
+    def addDir(self, path: str) -> None:
+        if path not in self.dirs:
+            self.addParents(path, "dir")
+            self.dirs[path] = {}
+
+    def addParents(self, path: str, type: str) -> None:
+        parent, _, name = path.rpartition("/")
+        self.addDir(parent)
+        self.dirs[parent].setdefault(name, type)
+
+    def isDir(self, path: str) -> bool:
+        return path in self.dirs
+
+    def isFile(self, path: str) -> bool:
+        return path in self.members
+
+    def entries(self, path: str = "") -> List[Dict[str, str]]:
+        return [
+            {"name": name, "type": type}
+            for name, type in sorted(
+                self.dirs[path].items(), key=lambda item: item[0].lower()
+            )
+        ]
+
+    def read(self, path: str) -> bytes:
+        if not self.isFile(path):
+            raise ValueError(f"{path} is not a file in the archive.")
+
+        return self.lha.read(self.members[path])
+
+    def extract(self, path: str, output: str) -> None:
+        if self.isFile(path):
+            with open(output, "wb") as fh:
+                fh.write(self.read(path))
+        elif self.isDir(path):
+            os.makedirs(output, exist_ok=True)
+            for entry in self.entries(path):
+                name = entry["name"]
+                self.extract(
+                    path + "/" + name if path else name, os.path.join(output, name)
+                )
+        else:
+            raise ValueError(f"{path} does not exist in the archive.")
@@ -0,0 +1,22 @@
+from typing import Any, Callable
+
+from PySide6.QtCore import QObject, QThread, Signal
+
+
+class Loader(QThread):
+    """Runs a blocking job off the GUI thread and reports back via signals."""
+
+    loaded = Signal(object)
+    failed = Signal(str)
+
+    def __init__(self, job: Callable[[], Any], parent: QObject) -> None:
+        super().__init__(parent)
+        self.job = job
+
+    def run(self) -> None:
+        try:
+            result = self.job()
+        except Exception as e:
+            self.failed.emit(str(e))
+        else:
+            self.loaded.emit(result)
@@ -0,0 +1,321 @@
+"""Build many ADF images in parallel from manifest files.
+
+A manifest is a JSON file describing one disk, or several under "disks"
+with shared settings under "defaults":
+
+    {
+        "defaults": {"dosType": "ffs", "bootblock": "boot.bin"},
+        "disks": [
+            {
+                "output": "out/game1.adf",
+                "volume": "Game1",
+                "files": [
+                    {"source": "build/c", "path": "C"},
+                    {"source": "build/game", "path": "Game", "protect": "rwed"},
+                    {"source": "README", "path": "README", "comment": "Read me"}
+                ]
+            }
+        ]
+    }
+
+Relative paths are resolved against the manifest's directory. Every
+timestamp on the disk is set to "date" (seconds since 1970 in UTC, no
+earlier than the Amiga epoch of 1978-01-01, which is also the default), so
+the same inputs always produce the same image. A hash of all inputs is
+stored next to each output, and images whose inputs have not changed are
+not built again.
+
+Usage: python mastering.py [-j JOBS] [--force] MANIFEST...
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from amitools.fs.ADFSVolume import ADFSVolume
+from amitools.fs.blkdev.BlkDevFactory import BlkDevFactory
+from amitools.fs.DosType import parse_dos_type_str
+from amitools.fs.MetaInfo import MetaInfo
+from amitools.fs.ProtectFlags import ProtectFlags
+from amitools.fs.RootMetaInfo import RootMetaInfo
+from amitools.fs.TimeStamp import TimeStamp
+from amitools.tools.xdftool import make_fsstr
+
+# Bump when a change here alters the images built from the same inputs
+BUILD_VERSION = 2
+
+DISK_SIZES = {"DD": 1760, "HD": 3520}
+BLOCK_BYTES = 512
+HASH_SUFFIX = ".inputs"
+
+# 1978-01-01 00:00 UTC in seconds since 1970
+AMIGA_EPOCH = 252460800
+
+
+class ManifestError(Exception):
+    pass
+
+
+def loadManifest(path: str) -> List[Dict[str, Any]]:
+    """Read a manifest and return its disks with defaults applied."""
+    try:
+        with open(path, "r", encoding="utf-8") as fh:
+            manifest = json.load(fh)
+    except (OSError, ValueError) as e:
+        raise ManifestError(f"{path}: {e}")
+
+    base = os.path.dirname(os.path.abspath(path))
+    defaults = manifest.get("defaults", {})
+    disks = manifest["disks"] if "disks" in manifest else [manifest]
+
+    result = []
+    for disk in disks:
+        disk = dict(defaults, **disk)
+
+        for key in ("output", "volume"):
+            if key not in disk:
+                raise ManifestError(f"{path}: every disk needs an '{key}'.")
+
+        disk["output"] = os.path.join(base, disk["output"])
+        if disk.get("bootblock"):
+            disk["bootblock"] = os.path.join(base, disk["bootblock"])
+        disk["files"] = [
+            dict(entry, source=os.path.join(base, entry["source"]))
+            for entry in disk.get("files", [])
+        ]
+        result.append(disk)
+
+    return result
+
+
+def walkSource(source: str, path: str) -> List[Tuple[str, str]]:
+    """List (host path, disk path) for a file or a directory tree, sorted."""
+    if not os.path.isdir(source):
+        return [(source, path)]
+
+    result = [(source, path)]
+    for name in sorted(os.listdir(source)):
+        result.extend(walkSource(os.path.join(source, name), path + "/" + name))
+    return result
+
+
+def inputHash(disk: Dict[str, Any]) -> str:
+    digest = hashlib.sha256()
+    spec = dict(disk, output=None)
+    digest.update(json.dumps([BUILD_VERSION, spec], sort_keys=True).encode("utf-8"))
+
+    sources = [(disk["bootblock"], "")] if disk.get("bootblock") else []
+    for entry in disk["files"]:
+        sources.extend(walkSource(entry["source"], entry["path"]))
+
+    # Directories count too, so adding an empty one triggers a rebuild
+    for source, disk_path in sources:
+        is_dir = os.path.isdir(source)
+        size = 0 if is_dir else os.path.getsize(source)
+        digest.update(json.dumps([source, disk_path, is_dir, size]).encode("utf-8"))
+
+        if not is_dir:
+            with open(source, "rb") as fh:
+                while chunk := fh.read(64 * 1024):
+                    digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def storedHash(output: str) -> Optional[str]:
+    try:
+        with open(output + HASH_SUFFIX, "r", encoding="utf-8") as fh:
+            return fh.read().strip()
+    except OSError:
+        return None
+
+
+def timeStamp(date: int) -> TimeStamp:
+    """Amiga time stamp for seconds since 1970 in UTC.
+
+    TimeStamp.from_secs counts from the Amiga epoch in local time, which
+    would make the image depend on the time zone of the build host.
+    """
+    secs = date - AMIGA_EPOCH
+    return TimeStamp(
+        days=secs // 86400, mins=secs % 86400 // 60, ticks=secs % 60 * 50
+    )
+
+
+def rootMetaInfo(date: int) -> RootMetaInfo:
+    return RootMetaInfo(
+        create_ts=timeStamp(date), disk_ts=timeStamp(date), mod_ts=timeStamp(date)
+    )
+
+
+def metaInfo(entry: Dict[str, Any], date: int, is_dir: bool = False) -> MetaInfo:
+    """Meta info for a disk entry; protect is a number or a flag string."""
+    comment = None if is_dir else entry.get("comment")
+
+    protect = entry.get("protect", 0)
+    protect_flags = None
+    if isinstance(protect, str):
+        protect_flags = ProtectFlags()
+        protect_flags.parse(protect)
+
+    return MetaInfo(
+        protect=protect if protect_flags is None else None,
+        mod_ts=timeStamp(date),
+        comment=make_fsstr(comment) if comment else None,
+        protect_flags=protect_flags,
+    )
+
+
+def master(disk: Dict[str, Any], path: str) -> None:
+    """Write the disk described by a manifest entry to path."""
+    date = int(disk.get("date", AMIGA_EPOCH))
+    if date < AMIGA_EPOCH:
+        raise ManifestError(f"Date {date} is before 1978, the start of Amiga time.")
+
+    size = DISK_SIZES[disk.get("size", "DD").upper()]
+
+    with open(path, "wb") as fh:
+        fh.truncate(size * BLOCK_BYTES)
+
+    dos_type = disk.get("dosType")
+    if isinstance(dos_type, str):
+        dos_type = parse_dos_type_str(dos_type)
+        if dos_type is None:
+            raise ManifestError(f"Unknown dos type {disk['dosType']}.")
+
+    bootblock = None
+    if disk.get("bootblock"):
+        with open(disk["bootblock"], "rb") as fh:
+            bootblock = fh.read()
+
+    blkdev = BlkDevFactory().open(path)
+    volume = ADFSVolume(blkdev)
+
+    try:
+        # A complete bootblock is copied as-is after formatting, anything
+        # shorter is treated as boot code and gets a fresh header
+        volume.create(
+            make_fsstr(disk["volume"]),
+            meta_info=rootMetaInfo(date),
+            dos_type=dos_type,
+            boot_code=bootblock if bootblock and len(bootblock) < 1024 else None,
+        )
+
+        dirs = {"": volume.get_root_dir()}
+        dir_meta = {"": metaInfo({}, date, True)}
+
+        for entry in disk["files"]:
+            for source, disk_path in walkSource(entry["source"], entry["path"]):
+                parent_path, _, name = disk_path.strip("/").rpartition("/")
+                parent = dirs.get(parent_path)
+
+                if parent is None:
+                    parent = volume.get_path_name(make_fsstr(parent_path))
+                    if parent is None or not parent.is_dir():
+                        raise ManifestError(f"Missing directory {parent_path}.")
+                    dirs[parent_path] = parent
+
+                if os.path.isdir(source):
+                    meta = metaInfo(entry, date, True)
+                    dirs[disk_path.strip("/")] = parent.create_dir(
+                        make_fsstr(name), meta
+                    )
+                    dir_meta[disk_path.strip("/")] = meta
+                else:
+                    with open(source, "rb") as fh:
+                        data = fh.read()
+                    parent.create_file(make_fsstr(name), data, metaInfo(entry, date))
+
+        # Creating entries stamps their parents with the current time. The
+        # volume's own dates were set by create and are left alone by amitools
+        for dir_path, node in dirs.items():
+            node.change_meta_info(dir_meta.get(dir_path, dir_meta[""]))
+
+        if bootblock and len(bootblock) == 1024:
+            for i in range(2):
+                blkdev.write_block(i, bootblock[i * BLOCK_BYTES : (i + 1) * BLOCK_BYTES])
+    finally:
+        volume.close()
+        blkdev.close()
+
+
+def build(disk: Dict[str, Any], force: bool = False) -> Tuple[str, str]:
+    """Build one disk unless its inputs are unchanged.
+
+    Returns the output path and "built", "skipped" or an error message.
+    """
+    output = disk["output"]
+
+    try:
+        digest = inputHash(disk)
+
+        if not force and os.path.exists(output) and storedHash(output) == digest:
+            return output, "skipped"
+
+        directory = os.path.dirname(output) or "."
+        os.makedirs(directory, exist_ok=True)
+
+        # Build next to the output and rename, so a failed or interrupted
+        # build never leaves a half-written image behind
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".adf")
+        os.close(fd)
+        try:
+            master(disk, temp_path)
+            os.replace(temp_path, output)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        with open(output + HASH_SUFFIX, "w", encoding="utf-8") as fh:
+            fh.write(digest + "\n")
+    except Exception as e:
+        return output, f"failed: {e}"
+
+    return output, "built"
+
+
+def buildAll(
+    disks: List[Dict[str, Any]], jobs: Optional[int] = None, force: bool = False
+) -> List[Tuple[str, str]]:
+    outputs = [disk["output"] for disk in disks]
+    duplicates = {output for output in outputs if outputs.count(output) > 1}
+
+    if duplicates:
+        raise ManifestError(f"Several disks write to {', '.join(sorted(duplicates))}.")
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        return list(pool.map(build, disks, [force] * len(disks)))
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Build ADF images from manifests.")
+    parser.add_argument("manifests", nargs="+", metavar="MANIFEST")
+    parser.add_argument("-j", "--jobs", type=int, default=None)
+    parser.add_argument("--force", action="store_true", help="rebuild everything")
+    args = parser.parse_args(argv)
+
+    if args.jobs is not None and args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+
+    try:
+        disks = [disk for path in args.manifests for disk in loadManifest(path)]
+        results = buildAll(disks, args.jobs, args.force)
+    except ManifestError as e:
+        print(e, file=sys.stderr)
+        return 2
+
+    failed = 0
+    for output, status in results:
+        print(f"{status}: {output}")
+        failed += status.startswith("failed")
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -25,8 +25,14 @@ class Menu:
         self.maxRecentFiles = 5
         self.updateRecentFiles([])  # Initialize with empty list
 
+        self.fileMenu.addAction(app.app_actions.saveAction)
+        self.fileMenu.addAction(app.app_actions.discardAction)
+        self.fileMenu.addAction(app.app_actions.optimizeAction)
         self.fileMenu.addAction(app.app_actions.quitAction)
 
+        self.editMenu: QMenu = self.menubar.addMenu("Edit")
+        self.editMenu.addAction(app.app_actions.undoAction)
+
     def updateRecentFiles(self, recent_files: List[str]) -> None:
         # Clear old actions
         for action in self.recentFilesActions:
@@ -0,0 +1,142 @@
+import os
+import struct
+from typing import List, Tuple
+
+from amitools.fs.ADFSVolume import ADFSVolume
+from amitools.fs.blkdev.BlkDevFactory import BlkDevFactory
+from amitools.fs.MetaInfo import MetaInfo
+
+
+class Optimizer:
+    """Rebuilds a volume into a new image with a tidy block layout.
+
+    Directories are created first, breadth-first from the root, so their
+    headers end up grouped together. Files follow one at a time on the empty
+    volume, so the blocks of each file are allocated contiguously.
+    """
+
+    def __init__(self, volume: ADFSVolume, blkdev) -> None:
+        self.volume = volume
+        self.blkdev = blkdev
+
+    def fileBlocks(self, blkdev, header_blk: int) -> List[int]:
+        """Return the header, extension and data blocks of a file."""
+        block_longs = blkdev.block_bytes // 4
+        table_size = block_longs - 56
+        blocks = [header_blk]
+        data = []
+        blk = header_blk
+
+        while blk:
+            longs = struct.unpack(f">{block_longs}I", blkdev.read_block(blk))
+            high_seq = longs[2]
+            table = longs[6 : 6 + table_size]
+            data.extend(p for p in list(reversed(table))[:high_seq] if p)
+
+            blk = longs[block_longs - 2]
+            if blk:
+                blocks.append(blk)
+
+        return blocks + data
+
+    def fragmentation(self, volume: ADFSVolume, blkdev) -> float:
+        """Percentage of gaps between the sorted blocks of each file.
+
+        0 means every file is stored in one contiguous run of blocks, no
+        matter in which order its header, extension and data blocks are.
+        Files may run across the root and bitmap blocks, which never move.
+        """
+        bitmap = volume.bitmap
+        fixed = {bitmap.root_blk.blk_num}
+        fixed.update(blk.blk_num for blk in bitmap.bitmap_blks + bitmap.ext_blks)
+
+        steps = 0
+        gaps = 0
+        pending = [volume.get_root_dir()]
+
+        while pending:
+            node = pending.pop()
+            for entry in node.get_entries_sorted_by_name():
+                if entry.is_dir():
+                    pending.append(entry)
+                    continue
+
+                blocks = sorted(set(self.fileBlocks(blkdev, entry.block.blk_num)))
+                steps += len(blocks) - 1
+                gaps += sum(
+                    1
+                    for a, b in zip(blocks, blocks[1:])
+                    if not all(blk in fixed for blk in range(a + 1, b))
+                )
+
+        return 100.0 * gaps / steps if steps else 0.0
+
+    def rebuild(self, output: str) -> Tuple[float, float]:
+        """Write an optimized copy of the volume to output.
+
+        Returns the fragmentation score before and after.
+        """
+        before = self.fragmentation(self.volume, self.blkdev)
+        block_bytes = self.blkdev.block_bytes
+
+        # An image of the same size gets the same geometry when opened
+        with open(output, "wb") as fh:
+            fh.truncate(self.blkdev.num_blocks * block_bytes)
+
+        # The output name may lack the .adf extension the type is detected by
+        try:
+            blkdev = BlkDevFactory().open(output, options={"type": "adf"})
+        except BaseException:
+            os.remove(output)
+            raise
+        volume = ADFSVolume(blkdev)
+
+        try:
+            volume.create(
+                self.volume.get_volume_name(),
+                meta_info=self.volume.get_meta_info(),
+                dos_type=self.volume.boot.dos_type,
+            )
+
+            # The root's creation and disk dates are set by create, and its
+            # modification date is restored with the other directories
+            dirs = [(self.volume.get_root_dir(), volume.get_root_dir())]
+            files = []
+            pending = [(self.volume.get_root_dir(), volume.get_root_dir())]
+
+            while pending:
+                source, target = pending.pop(0)
+                for entry in source.get_entries_sorted_by_name():
+                    name = entry.get_file_name().get_name()
+                    if entry.is_dir():
+                        node = target.create_dir(name, entry.get_meta_info())
+                        dirs.append((entry, node))
+                        pending.append((entry, node))
+                    else:
+                        files.append((target, name, entry))
+
+            for target, name, entry in files:
+                target.create_file(name, entry.get_file_data(), entry.get_meta_info())
+
+            # Adding entries touched the directory dates, so put them back.
+            # Only the date: protection bits and comment were set on creation
+            for entry, node in reversed(dirs):
+                node.change_meta_info(
+                    MetaInfo(mod_ts=entry.get_meta_info().get_mod_ts())
+                )
+
+            # Keep the original boot code, not just the dos type
+            for blk_num in range(self.blkdev.reserved):
+                blkdev.write_block(blk_num, self.blkdev.read_block(blk_num))
+
+            after = self.fragmentation(volume, blkdev)
+        except BaseException:
+            volume.close()
+            blkdev.close()
+            os.remove(output)
+            raise
+
+        volume.close()
+        blkdev.close()
+
+        return before, after
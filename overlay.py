@@ -0,0 +1,207 @@
+import os
+import struct
+import tempfile
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+JOURNAL_MAGIC = b"ADFJ"
+JOURNAL_VERSION = 1
+JOURNAL_HEADER = ">4sHHI"
+JOURNAL_TRAILER = ">II"
+
+
+class JournalError(Exception):
+    pass
+
+
+class Journal:
+    """Write-ahead journal of dirty blocks for an image file.
+
+    The journal is written to a temporary file and renamed next to the image
+    before any block of the image is touched. If applying it is interrupted,
+    the complete journal is still there and is replayed on the next open.
+    """
+
+    def __init__(self, image_path: str) -> None:
+        self.image_path = image_path
+        self.path = image_path + ".journal"
+
+    def pending(self) -> bool:
+        return os.path.exists(self.path)
+
+    def write(self, blocks: Dict[int, bytes], block_bytes: int) -> None:
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        crc = 0
+
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                fh.write(
+                    struct.pack(
+                        JOURNAL_HEADER,
+                        JOURNAL_MAGIC,
+                        JOURNAL_VERSION,
+                        block_bytes,
+                        len(blocks),
+                    )
+                )
+                for blk_num in sorted(blocks):
+                    record = struct.pack(">I", blk_num) + blocks[blk_num]
+                    crc = zlib.crc32(record, crc)
+                    fh.write(record)
+                fh.write(struct.pack(JOURNAL_TRAILER, len(blocks), crc))
+                fh.flush()
+                os.fsync(fh.fileno())
+            os.replace(temp_path, self.path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def read(self) -> Tuple[int, Dict[int, bytes]]:
+        with open(self.path, "rb") as fh:
+            data = fh.read()
+
+        header_size = struct.calcsize(JOURNAL_HEADER)
+        trailer_size = struct.calcsize(JOURNAL_TRAILER)
+
+        if len(data) < header_size + trailer_size:
+            raise JournalError("Journal is truncated.")
+
+        magic, version, block_bytes, count = struct.unpack_from(JOURNAL_HEADER, data)
+
+        if magic != JOURNAL_MAGIC or version != JOURNAL_VERSION:
+            raise JournalError("Not an image journal.")
+
+        record_size = 4 + block_bytes
+        body = data[header_size : header_size + count * record_size]
+        trailer = data[header_size + count * record_size :]
+
+        if len(body) != count * record_size or len(trailer) != trailer_size:
+            raise JournalError("Journal is truncated.")
+
+        if struct.unpack(JOURNAL_TRAILER, trailer) != (count, zlib.crc32(body)):
+            raise JournalError("Journal checksum mismatch.")
+
+        blocks = {}
+        for offset in range(0, len(body), record_size):
+            blk_num = struct.unpack_from(">I", body, offset)[0]
+            blocks[blk_num] = body[offset + 4 : offset + record_size]
+
+        return block_bytes, blocks
+
+    def apply(self) -> None:
+        """Write the journalled blocks into the image and drop the journal."""
+        block_bytes, blocks = self.read()
+
+        with open(self.image_path, "r+b") as fh:
+            for blk_num, data in sorted(blocks.items()):
+                fh.seek(blk_num * block_bytes)
+                fh.write(data)
+            fh.flush()
+            os.fsync(fh.fileno())
+
+        os.remove(self.path)
+
+    def recover(self) -> bool:
+        """Finish a save that was interrupted. Returns True if one was found."""
+        if not self.pending():
+            return False
+
+        try:
+            self.apply()
+        except JournalError:
+            # An incomplete journal never made it past the rename, so the
+            # image itself was not touched yet
+            os.remove(self.path)
+            return False
+
+        return True
+
+
+class OverlayBlockDevice:
+    """Copy-on-write layer on top of a read-only block device.
+
+    Written blocks are kept in memory and shadow the base image. Writes are
+    grouped into transactions that record the previous contents of every
+    block they touch, which is what undo restores.
+    """
+
+    def __init__(self, base, max_undo: int = 100) -> None:
+        self.base = base
+        self.max_undo = max_undo
+        self.blocks: Dict[int, bytes] = {}
+        self.undo_stack: List[Tuple[str, Dict[int, Optional[bytes]]]] = []
+        self.current: Optional[Dict[int, Optional[bytes]]] = None
+        self.current_label: str = ""
+
+    def __getattr__(self, name: str):
+        # Geometry and everything else comes from the base device
+        return getattr(self.base, name)
+
+    def read_block(self, blk_num: int, num_blks: int = 1) -> bytes:
+        if num_blks == 1:
+            block = self.blocks.get(blk_num)
+            return block if block is not None else bytes(self.base.read_block(blk_num))
+
+        return b"".join(self.read_block(blk_num + i) for i in range(num_blks))
+
+    def write_block(self, blk_num: int, data: bytes, num_blks: int = 1) -> None:
+        block_bytes = self.base.block_bytes
+
+        for i in range(num_blks):
+            n = blk_num + i
+            if self.current is not None and n not in self.current:
+                self.current[n] = self.blocks.get(n)
+            self.blocks[n] = bytes(data[i * block_bytes : (i + 1) * block_bytes])
+
+    def flush(self) -> None:
+        # Changes stay in the overlay until they are saved explicitly
+        pass
+
+    def close(self) -> None:
+        self.base.close()
+
+    def begin(self, label: str) -> None:
+        self.current = {}
+        self.current_label = label
+
+    def commit(self) -> None:
+        if self.current:
+            self.undo_stack.append((self.current_label, self.current))
+            del self.undo_stack[: -self.max_undo]
+        self.current = None
+
+    def rollback(self) -> None:
+        if self.current:
+            self.restore(self.current)
+        self.current = None
+
+    def restore(self, previous: Dict[int, Optional[bytes]]) -> None:
+        for blk_num, data in previous.items():
+            if data is None:
+                self.blocks.pop(blk_num, None)
+            else:
+                self.blocks[blk_num] = data
+
+    def undo(self) -> Optional[str]:
+        if not self.undo_stack:
+            return None
+
+        label, previous = self.undo_stack.pop()
+        self.restore(previous)
+        return label
+
+    def undoLabel(self) -> Optional[str]:
+        return self.undo_stack[-1][0] if self.undo_stack else None
+
+    def isDirty(self) -> bool:
+        return bool(self.blocks)
+
+    def discard(self) -> None:
+        self.blocks.clear()
+        self.undo_stack.clear()
+        self.current = None
+
+    def dirtyBlocks(self) -> Dict[int, bytes]:
+        return dict(self.blocks)
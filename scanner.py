@@ -0,0 +1,253 @@
+"""Screen disk images for known bootblocks, such as viruses and loaders.
+
+Only the bootblock is read from each image (plus, on request, the raw
+blocks after it), and every signature is matched against it in a single
+pass with an Aho-Corasick automaton. Images are scanned in worker
+processes.
+
+The signature database is a JSON list of entries like
+
+    {"name": "SCA", "class": "virus", "text": "Your AMIGA is alive"}
+    {"name": "Some loader", "class": "loader", "hex": "4e75 4e71"}
+
+Usage: python scanner.py [-j JOBS] [--db FILE] [--blocks N] [--json] FOLDER
+"""
+
+import argparse
+import gzip
+import json
+import os
+import struct
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Set
+
+from dms import DMS
+
+BOOTBLOCK_SIZE = 1024
+BLOCK_SIZE = 512
+DEFAULT_DATABASE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "signatures.json"
+)
+IMAGE_EXTENSIONS = (".adf", ".adz", ".adf.gz", ".dms")
+
+# Most severe first; a bootblock is classified by its most severe match
+CLASS_PRIORITY = ["virus", "loader", "utility", "standard"]
+
+
+class AhoCorasick:
+    """Multi-pattern byte matcher that finds all patterns in one pass."""
+
+    def __init__(self, patterns: List[bytes]) -> None:
+        self.goto: List[Dict[int, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.output: List[Set[int]] = [set()]
+
+        for index, pattern in enumerate(patterns):
+            state = 0
+            for byte in pattern:
+                if byte not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(set())
+                    self.goto[state][byte] = len(self.goto) - 1
+                state = self.goto[state][byte]
+            self.output[state].add(index)
+
+        # Breadth-first, so the failure state of a parent is always known
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for byte, child in self.goto[state].items():
+                queue.append(child)
+                fail = self.fail[state]
+                while fail and byte not in self.goto[fail]:
+                    fail = self.fail[fail]
+                target = self.goto[fail].get(byte, 0)
+                self.fail[child] = target if target != child else 0
+                self.output[child] |= self.output[self.fail[child]]
+
+    def search(self, data: bytes) -> Set[int]:
+        found: Set[int] = set()
+        state = 0
+
+        for byte in data:
+            while state and byte not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(byte, 0)
+            found |= self.output[state]
+
+        return found
+
+
+def loadSignatures(path: str = DEFAULT_DATABASE) -> List[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as fh:
+        signatures = json.load(fh)
+
+    for signature in signatures:
+        if "hex" in signature:
+            signature["pattern"] = bytes.fromhex(signature["hex"])
+        elif "text" in signature:
+            signature["pattern"] = signature["text"].encode("latin-1")
+        else:
+            raise ValueError(f"Signature {signature.get('name')} has no pattern.")
+
+    return signatures
+
+
+def bootblockChecksum(data: bytes) -> int:
+    total = 0
+    for (value,) in struct.iter_unpack(">I", data[:BOOTBLOCK_SIZE]):
+        total += value
+        if total > 0xFFFFFFFF:
+            total = (total & 0xFFFFFFFF) + 1
+    return total
+
+
+class Scanner:
+    def __init__(self, signatures: List[Dict[str, Any]]) -> None:
+        self.signatures = signatures
+        self.automaton = AhoCorasick([s["pattern"] for s in signatures])
+
+    def rank(self, signature: Dict[str, Any]) -> int:
+        kind = signature.get("class")
+        if kind in CLASS_PRIORITY:
+            return CLASS_PRIORITY.index(kind)
+        return len(CLASS_PRIORITY)
+
+    def classify(self, data: bytes) -> Dict[str, Any]:
+        """Classify a bootblock, optionally followed by more raw blocks."""
+        matches = sorted(
+            (self.signatures[i] for i in self.automaton.search(data)),
+            key=self.rank,
+        )
+        bootblock = data[:BOOTBLOCK_SIZE]
+        is_dos = bootblock[:3] == b"DOS"
+        bootable = is_dos and bootblockChecksum(bootblock) == 0xFFFFFFFF
+
+        if matches:
+            classification = matches[0].get("class", "unknown")
+        elif not is_dos:
+            classification = "non-dos"
+        elif not any(bootblock[12:]):
+            classification = "empty"
+        else:
+            classification = "unknown"
+
+        return {
+            "classification": classification,
+            "matches": [s["name"] for s in matches],
+            "bootable": bootable,
+        }
+
+
+def readBootArea(path: str, blocks: int = 0) -> bytes:
+    """Read the bootblock and the given number of blocks after it."""
+    size = BOOTBLOCK_SIZE + blocks * BLOCK_SIZE
+    lower = path.lower()
+
+    if lower.endswith(".dms"):
+        data = bytearray()
+        with open(path, "rb") as fh:
+            for track in DMS().tracks(fh):
+                data += track
+                if len(data) >= size:
+                    break
+        return bytes(data[:size])
+
+    opener = gzip.open if lower.endswith((".adz", ".gz")) else open
+    with opener(path, "rb") as fh:
+        return fh.read(size)
+
+
+_scanner: Optional[Scanner] = None
+
+
+def _initWorker(signatures: List[Dict[str, Any]]) -> None:
+    global _scanner
+    _scanner = Scanner(signatures)
+
+
+def scanImage(path: str, blocks: int = 0) -> Dict[str, Any]:
+    try:
+        result = _scanner.classify(readBootArea(path, blocks))
+    except Exception as e:
+        result = {"classification": "error", "matches": [], "error": str(e)}
+
+    result["path"] = path
+    return result
+
+
+def findImages(folder: str) -> List[str]:
+    images = []
+    for root, _, files in os.walk(folder):
+        images.extend(
+            os.path.join(root, name)
+            for name in files
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+    return sorted(images)
+
+
+def scanFolder(
+    folder: str,
+    signatures: List[Dict[str, Any]],
+    blocks: int = 0,
+    jobs: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    images = findImages(folder)
+
+    with ProcessPoolExecutor(
+        max_workers=jobs, initializer=_initWorker, initargs=(signatures,)
+    ) as pool:
+        return list(
+            pool.map(scanImage, images, [blocks] * len(images), chunksize=16)
+        )
+
+
+_defaultScanner: Optional[Scanner] = None
+
+
+def classifyBootblock(data: bytes) -> Dict[str, Any]:
+    """Classify a bootblock against the bundled signature database."""
+    global _defaultScanner
+    if _defaultScanner is None:
+        _defaultScanner = Scanner(loadSignatures())
+    return _defaultScanner.classify(data)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Scan disk images for known bootblocks."
+    )
+    parser.add_argument("folder")
+    parser.add_argument("-j", "--jobs", type=int, default=None)
+    parser.add_argument("--db", default=DEFAULT_DATABASE, help="signature database")
+    parser.add_argument(
+        "--blocks",
+        type=int,
+        default=0,
+        help="also scan this many blocks after the bootblock",
+    )
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    if args.jobs is not None and args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+
+    results = scanFolder(args.folder, loadSignatures(args.db), args.blocks, args.jobs)
+
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        for result in results:
+            detail = ", ".join(result["matches"]) or result.get("error", "")
+            print(f"{result['classification']:<10} {result['path']}  {detail}".rstrip())
+
+    return 1 if any(r["classification"] == "virus" for r in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
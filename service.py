@@ -0,0 +1,514 @@
+"""Local JSON-RPC service exposing ADF operations to other tools.
+
+Clients connect to a Unix socket (or a TCP port on localhost) and send one
+JSON-RPC 2.0 request per line; each response is written back as one line.
+
+Methods:
+    open(image)                              -> volume name and info
+    list(image, path="/")                    -> directory entries
+    stat(image, path)                        -> details of one entry
+    read(image, path, offset=0, length=None) -> base64 encoded file data
+    write(image, path, data)                 -> writes base64 data to a file,
+                                                keeping protection bits and
+                                                comment of a replaced file
+    close(image)                             -> drops the pooled handle
+    stats()                                  -> latency, throughput and pool counters
+
+Usage: python service.py [--socket PATH | --port PORT]
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from amitools.fs.ADFSVolume import ADFSVolume
+from amitools.fs.block.FileDataBlock import FileDataBlock
+from amitools.fs.MetaInfo import MetaInfo
+from amitools.tools.xdftool import make_fsstr
+
+from adf import ADF
+from image_cache import ImageCache
+from overlay import Journal
+
+DEFAULT_SOCKET = "/tmp/adf-explorer.sock"
+DEFAULT_MAX_HANDLES = 16
+DEFAULT_IDLE_TIMEOUT = 300.0
+
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+SERVER_ERROR = -32000
+
+
+class RPCError(Exception):
+    def __init__(self, code: int, message: str) -> None:
+        super().__init__(message)
+        self.code = code
+
+
+def volumePath(path: str) -> str:
+    return path.strip("/") or "/"
+
+
+class VolumeHandle:
+    """An open image shared by all clients, used by one request at a time."""
+
+    def __init__(self, path: str, blkdev, volume: ADFSVolume, readOnly: bool) -> None:
+        self.path = path
+        self.blkdev = blkdev
+        self.volume = volume
+        self.readOnly = readOnly
+        self.lock = asyncio.Lock()
+        self.lastUsed = time.monotonic()
+        self.closed = False
+
+    def node(self, path: str):
+        node = self.volume.get_path_name(make_fsstr(volumePath(path)))
+
+        if node is None:
+            raise RPCError(INVALID_PARAMS, f"{path} does not exist.")
+
+        return node
+
+    def describe(self, node) -> Dict[str, Any]:
+        meta = node.get_meta_info()
+        return {
+            "name": node.get_file_name().get_name().__str__(),
+            "type": "dir" if node.is_dir() else "file",
+            "size": 0 if node.is_dir() else node.block.byte_size,
+            "protect": meta.get_protect_str(),
+            "comment": meta.get_comment().__str__() if meta.get_comment() else "",
+            "modified": meta.get_mod_ts().__str__(),
+        }
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "volumeName": self.volume.get_volume_name().__str__(),
+            "volumeInfo": self.volume.get_info().__str__(),
+            "readOnly": self.readOnly,
+        }
+
+    def list(self, path: str = "/") -> List[Dict[str, Any]]:
+        node = self.node(path)
+
+        if not node.is_dir():
+            raise RPCError(INVALID_PARAMS, f"{path} is not a directory.")
+
+        return [self.describe(entry) for entry in node.get_entries_sorted_by_name()]
+
+    def stat(self, path: str) -> Dict[str, Any]:
+        return self.describe(self.node(path))
+
+    def read(self, path: str, offset: int = 0, length: Optional[int] = None) -> bytes:
+        """Read a range of a file, loading only the data blocks it covers."""
+        node = self.node(path)
+
+        if not node.is_file():
+            raise RPCError(INVALID_PARAMS, f"{path} is not a file.")
+
+        size = node.block.byte_size
+        end = size if length is None else min(size, offset + length)
+        if offset >= end:
+            return b""
+
+        per_block = node.get_data_block_contents_bytes()
+        first = offset // per_block
+        last = (end - 1) // per_block
+        data = bytearray()
+
+        for blk_num in node.data_blk_nums[first : last + 1]:
+            if self.volume.is_ffs:
+                data += self.blkdev.read_block(blk_num)
+            else:
+                block = FileDataBlock(self.blkdev, blk_num)
+                block.read()
+                if not block.valid:
+                    raise RPCError(SERVER_ERROR, f"{path} has a broken data block.")
+                data += block.get_block_data()
+
+        start = offset - first * per_block
+        return bytes(data[start : start + end - offset])
+
+    def write(self, path: str, data: bytes) -> None:
+        """Write a file and save the image right away.
+
+        An existing file is replaced, keeping its protection bits and comment.
+        """
+        if self.readOnly:
+            raise RPCError(SERVER_ERROR, f"{self.path} is opened read-only.")
+
+        parent, _, name = volumePath(path).rpartition("/")
+
+        self.blkdev.begin(f"Write {path}")
+        try:
+            meta = None
+            existing = self.volume.get_path_name(make_fsstr(volumePath(path)))
+            if existing is not None:
+                if not existing.is_file():
+                    raise RPCError(INVALID_PARAMS, f"{path} is not a file.")
+                old_meta = existing.get_meta_info()
+                meta = MetaInfo(
+                    protect=old_meta.get_protect(), comment=old_meta.get_comment()
+                )
+                meta.set_current_as_mod_time()
+                self.volume.delete(make_fsstr(volumePath(path)))
+
+            directory = self.node(parent or "/")
+            if not directory.is_dir():
+                raise RPCError(INVALID_PARAMS, f"{parent} is not a directory.")
+            directory.create_file(make_fsstr(name), data, meta).flush()
+            self.volume.bitmap.write()
+        except BaseException:
+            self.blkdev.rollback()
+            raise
+        self.blkdev.commit()
+
+        journal = Journal(self.path)
+        journal.write(self.blkdev.dirtyBlocks(), self.blkdev.block_bytes)
+        journal.apply()
+
+    def close(self) -> None:
+        self.closed = True
+        self.volume.close()
+        self.blkdev.close()
+
+
+class Stats:
+    def __init__(self) -> None:
+        self.started = time.monotonic()
+        self.methods: Dict[str, Dict[str, float]] = {}
+        self.bytesRead = 0
+        self.bytesWritten = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def record(self, method: str, seconds: float, error: bool) -> None:
+        entry = self.methods.setdefault(
+            method, {"calls": 0, "errors": 0, "totalMs": 0.0, "maxMs": 0.0}
+        )
+        entry["calls"] += 1
+        entry["errors"] += int(error)
+        entry["totalMs"] += seconds * 1000
+        entry["maxMs"] = max(entry["maxMs"], seconds * 1000)
+
+    def report(self, handles: int) -> Dict[str, Any]:
+        uptime = time.monotonic() - self.started
+        return {
+            "uptime": uptime,
+            "methods": {
+                method: dict(entry, meanMs=entry["totalMs"] / entry["calls"])
+                for method, entry in self.methods.items()
+            },
+            "bytesRead": self.bytesRead,
+            "bytesWritten": self.bytesWritten,
+            "readThroughput": self.bytesRead / uptime if uptime else 0.0,
+            "writeThroughput": self.bytesWritten / uptime if uptime else 0.0,
+            "pool": {
+                "handles": handles,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            },
+        }
+
+
+class VolumePool:
+    """Bounded LRU pool of open volumes, evicting handles left idle."""
+
+    def __init__(
+        self,
+        stats: Stats,
+        maxHandles: int = DEFAULT_MAX_HANDLES,
+        idleTimeout: float = DEFAULT_IDLE_TIMEOUT,
+    ) -> None:
+        self.stats = stats
+        self.maxHandles = maxHandles
+        self.idleTimeout = idleTimeout
+        self.handles: "OrderedDict[str, VolumeHandle]" = OrderedDict()
+        self.opening: Dict[str, asyncio.Future] = {}
+        self.executor = ThreadPoolExecutor()
+        self.loader = ADF(
+            None,
+            ImageCache(
+                os.path.join(os.path.expanduser("~"), ".cache", "adf-explorer", "images")
+            ),
+        )
+
+    async def run(self, job: Callable[..., Any], *args: Any) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, job, *args
+        )
+
+    async def acquire(self, path: str) -> VolumeHandle:
+        path = os.path.abspath(path)
+        handle = self.handles.get(path)
+
+        if handle:
+            self.stats.hits += 1
+            self.handles.move_to_end(path)
+            return handle
+
+        # Concurrent requests for the same image share a single open
+        if path in self.opening:
+            self.stats.hits += 1
+            return await asyncio.shield(self.opening[path])
+
+        self.stats.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self.opening[path] = future
+
+        try:
+            if not os.path.isfile(path):
+                raise RPCError(INVALID_PARAMS, f"{path} does not exist.")
+            handle = VolumeHandle(path, *await self.run(self.loader.load, path))
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved if nobody else was waiting
+            future.exception()
+            raise
+        finally:
+            del self.opening[path]
+
+        self.handles[path] = handle
+        future.set_result(handle)
+        await self.trim(keep=path)
+        return handle
+
+    async def drop(self, path: str) -> bool:
+        handle = self.handles.pop(os.path.abspath(path), None)
+
+        if not handle:
+            return False
+
+        async with handle.lock:
+            await self.run(handle.close)
+        self.stats.evictions += 1
+        return True
+
+    async def trim(self, keep: str) -> None:
+        # Least recently used handles go first. Busy ones and the handle
+        # about to be returned are skipped, so the pool may briefly hold
+        # more than maxHandles while every other handle is in use
+        for path, handle in list(self.handles.items()):
+            if len(self.handles) <= self.maxHandles:
+                break
+            if path != keep and not handle.lock.locked():
+                await self.drop(path)
+
+    async def evictIdle(self) -> None:
+        while True:
+            await asyncio.sleep(max(1.0, self.idleTimeout / 4))
+            now = time.monotonic()
+            for path, handle in list(self.handles.items()):
+                if now - handle.lastUsed > self.idleTimeout and not handle.lock.locked():
+                    await self.drop(path)
+
+    async def closeAll(self) -> None:
+        for path in list(self.handles):
+            await self.drop(path)
+        self.executor.shutdown()
+
+
+class Service:
+    def __init__(self, pool: VolumePool, stats: Stats) -> None:
+        self.pool = pool
+        self.stats = stats
+        self.methods: Dict[str, Callable[..., Any]] = {
+            "open": self.open,
+            "list": self.list,
+            "stat": self.stat,
+            "read": self.read,
+            "write": self.write,
+            "close": self.close,
+            "stats": self.report,
+        }
+
+    async def withHandle(self, image: str, job: Callable[..., Any], *args: Any) -> Any:
+        while True:
+            handle = await self.pool.acquire(image)
+
+            async with handle.lock:
+                # The handle may have been evicted while this request waited
+                if handle.closed:
+                    continue
+
+                handle.lastUsed = time.monotonic()
+                try:
+                    return await self.pool.run(job, handle, *args)
+                finally:
+                    handle.lastUsed = time.monotonic()
+
+    async def open(self, image: str) -> Dict[str, Any]:
+        return await self.withHandle(image, VolumeHandle.info)
+
+    async def list(self, image: str, path: str = "/") -> List[Dict[str, Any]]:
+        return await self.withHandle(image, VolumeHandle.list, path)
+
+    async def stat(self, image: str, path: str) -> Dict[str, Any]:
+        return await self.withHandle(image, VolumeHandle.stat, path)
+
+    async def read(
+        self, image: str, path: str, offset: int = 0, length: Optional[int] = None
+    ) -> Dict[str, Any]:
+        if offset < 0 or (length is not None and length < 0):
+            raise RPCError(INVALID_PARAMS, "offset and length must not be negative.")
+
+        data = await self.withHandle(image, VolumeHandle.read, path, offset, length)
+        self.stats.bytesRead += len(data)
+        return {
+            "offset": offset,
+            "length": len(data),
+            "data": base64.b64encode(data).decode("ascii"),
+        }
+
+    async def write(self, image: str, path: str, data: str) -> Dict[str, Any]:
+        try:
+            raw = base64.b64decode(data, validate=True)
+        except ValueError:
+            raise RPCError(INVALID_PARAMS, "data must be base64 encoded.")
+
+        try:
+            await self.withHandle(image, VolumeHandle.write, path, raw)
+        finally:
+            # The image changed on disk, or the volume state may be left
+            # half-updated by a failed write, so start from a fresh handle
+            await self.pool.drop(image)
+        self.stats.bytesWritten += len(raw)
+        return {"length": len(raw)}
+
+    async def close(self, image: str) -> bool:
+        return await self.pool.drop(image)
+
+    async def report(self) -> Dict[str, Any]:
+        return self.stats.report(len(self.pool.handles))
+
+    async def dispatch(self, request: Any) -> Optional[Dict[str, Any]]:
+        if (
+            not isinstance(request, dict)
+            or request.get("jsonrpc") != "2.0"
+            or not isinstance(request.get("method"), str)
+        ):
+            return self.error(None, INVALID_REQUEST, "Invalid request.")
+
+        response = await self.call(request)
+
+        # Notifications never get a response, not even an error
+        if "id" not in request:
+            return None
+
+        return response
+
+    async def call(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        request_id = request.get("id")
+        method = self.methods.get(request["method"])
+        params = request.get("params", {})
+
+        if method is None:
+            return self.error(request_id, METHOD_NOT_FOUND, "Method not found.")
+
+        started = time.monotonic()
+        error = True
+        try:
+            if isinstance(params, list):
+                result = await method(*params)
+            elif isinstance(params, dict):
+                result = await method(**params)
+            else:
+                raise RPCError(INVALID_PARAMS, "params must be a list or an object.")
+            error = False
+        except RPCError as e:
+            return self.error(request_id, e.code, str(e))
+        except TypeError as e:
+            return self.error(request_id, INVALID_PARAMS, str(e))
+        except Exception as e:
+            return self.error(request_id, SERVER_ERROR, str(e))
+        finally:
+            self.stats.record(request["method"], time.monotonic() - started, error)
+
+        return {"jsonrpc": "2.0", "id": request_id, "result": result}
+
+    def error(self, request_id: Any, code: int, message: str) -> Dict[str, Any]:
+        return {
+            "jsonrpc": "2.0",
+            "id": request_id,
+            "error": {"code": code, "message": message},
+        }
+
+    async def handleClient(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            while line := await reader.readline():
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    response = self.error(None, PARSE_ERROR, "Parse error.")
+                else:
+                    response = await self.dispatch(request)
+
+                if response is not None:
+                    writer.write(json.dumps(response).encode("utf-8") + b"\n")
+                    await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(args: argparse.Namespace) -> None:
+    stats = Stats()
+    pool = VolumePool(stats, args.max_handles, args.idle_timeout)
+    service = Service(pool, stats)
+    # Large reads are base64 encoded on a single line
+    limit = 64 * 1024 * 1024
+
+    if args.port is not None:
+        server = await asyncio.start_server(
+            service.handleClient, "127.0.0.1", args.port, limit=limit
+        )
+    else:
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        server = await asyncio.start_unix_server(
+            service.handleClient, args.socket, limit=limit
+        )
+        os.chmod(args.socket, 0o600)
+
+    evictor = asyncio.create_task(pool.evictIdle())
+
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        evictor.cancel()
+        await pool.closeAll()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Serve ADF operations locally.")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--socket", default=DEFAULT_SOCKET, help="Unix socket path")
+    group.add_argument("--port", type=int, help="TCP port on 127.0.0.1")
+    parser.add_argument("--max-handles", type=int, default=DEFAULT_MAX_HANDLES)
+    parser.add_argument("--idle-timeout", type=float, default=DEFAULT_IDLE_TIMEOUT)
+    args = parser.parse_args(argv)
+
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
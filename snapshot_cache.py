@@ -0,0 +1,113 @@
+import hashlib
+import json
+import os
+import tempfile
+from typing import Any, Dict, Optional
+
+from image_cache import fileHash
+
+SNAPSHOT_VERSION = 1
+DEFAULT_MAX_ENTRIES = 50
+
+
+class SnapshotCache:
+    """Persistent snapshots of image directory trees for instant reopen.
+
+    A snapshot is stored per image path and is only trusted while the image
+    still has the same size and content. A changed modification time alone
+    triggers a hash comparison instead of invalidating the snapshot.
+    """
+
+    def __init__(self, directory: str, maxEntries: int = DEFAULT_MAX_ENTRIES) -> None:
+        self.directory = directory
+        self.maxEntries = maxEntries
+
+    def entryPath(self, path: str) -> str:
+        name = hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, name + ".json")
+
+    def load(self, path: str) -> Optional[Dict[str, Any]]:
+        try:
+            stat = os.stat(path)
+            with open(self.entryPath(path), "r", encoding="utf-8") as fh:
+                snapshot = json.load(fh)
+        except (OSError, ValueError):
+            return None
+
+        key = snapshot.get("key", {})
+
+        if (
+            snapshot.get("version") != SNAPSHOT_VERSION
+            or key.get("path") != os.path.abspath(path)
+            or key.get("size") != stat.st_size
+        ):
+            return None
+
+        if key.get("mtime") != stat.st_mtime_ns:
+            try:
+                if key.get("hash") != fileHash(path):
+                    return None
+            except OSError:
+                return None
+
+            key["mtime"] = stat.st_mtime_ns
+            self.write(path, snapshot)
+        else:
+            try:
+                os.utime(self.entryPath(path))
+            except OSError:
+                pass
+
+        return snapshot
+
+    def save(self, path: str, snapshot: Dict[str, Any]) -> None:
+        try:
+            stat = os.stat(path)
+            snapshot = dict(
+                snapshot,
+                version=SNAPSHOT_VERSION,
+                key={
+                    "path": os.path.abspath(path),
+                    "size": stat.st_size,
+                    "mtime": stat.st_mtime_ns,
+                    "hash": fileHash(path),
+                },
+            )
+        except OSError:
+            return
+
+        self.write(path, snapshot)
+        self.evict()
+
+    def write(self, path: str, snapshot: Dict[str, Any]) -> None:
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        except OSError:
+            return
+
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as fh:
+                json.dump(snapshot, fh, separators=(",", ":"))
+            os.replace(temp_path, self.entryPath(path))
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def evict(self) -> None:
+        try:
+            entries = [
+                entry
+                for entry in os.scandir(self.directory)
+                if entry.is_file() and entry.name.endswith(".json")
+            ]
+        except OSError:
+            return
+
+        entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+
+        for entry in entries[self.maxEntries :]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
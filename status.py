@@ -1,3 +1,5 @@
+from typing import Any, Dict, Optional
+
 from PySide6.QtWidgets import QLabel, QStatusBar
 
 
@@ -6,10 +8,30 @@ class Status():
         self.statusBarMessage: QLabel = QLabel()
         self.statusBarMessage.setText('No file open')
 
+        self.bootblockMessage: QLabel = QLabel()
+
         self.statusBar: QStatusBar = QStatusBar()
         self.statusBar.addWidget(self.statusBarMessage)
+        self.statusBar.addPermanentWidget(self.bootblockMessage)
 
         app.setStatusBar(self.statusBar)
 
     def setText(self, text: str) -> None:
         self.statusBarMessage.setText(text)
+
+    def setBootblock(self, info: Optional[Dict[str, Any]]) -> None:
+        if not info:
+            self.bootblockMessage.setText("")
+            self.bootblockMessage.setStyleSheet("")
+            return
+
+        text = f"Bootblock: {info['classification']}"
+        if info["matches"]:
+            text += f" ({', '.join(info['matches'])})"
+
+        self.bootblockMessage.setText(text)
+        self.bootblockMessage.setStyleSheet(
+            "color: red; font-weight: bold;"
+            if info["classification"] == "virus"
+            else ""
+        )
@@ -0,0 +1,626 @@
+"""Minimal DMS packer used to build the DMS test fixtures.
+
+It is written from the format as documented by xDMS and LZHUF rather than
+from dms.py, so the fixtures check the decoder against a second
+implementation. Matches are found greedily; it is not meant to pack real
+disks well.
+
+Usage: python tests/dms_packer.py (rewrites the fixtures in tests/data)
+"""
+
+import gzip
+import heapq
+import os
+import random
+import struct
+import sys
+import tempfile
+from typing import Dict, List, Optional, Tuple
+
+TRACK_SIZE = 11264
+
+NOCOMP, RLE, QUICK, MEDIUM, DEEP, HEAVY1, HEAVY2 = range(7)
+MODES = {
+    "nocomp": NOCOMP,
+    "rle": RLE,
+    "quick": QUICK,
+    "medium": MEDIUM,
+    "deep": DEEP,
+    "heavy1": HEAVY1,
+    "heavy2": HEAVY2,
+}
+
+# Upper six bits of a Medium/Deep position (and the Medium match length)
+# are sent with the LZHUF code of 1 three-bit, 3 four-bit, 8 five-bit,
+# 12 six-bit, 24 seven-bit and 16 eight-bit codes, assigned in order
+P_CODES: List[Tuple[int, int]] = []
+_code = 0
+for _length, _count in ((3, 1), (4, 3), (5, 8), (6, 12), (7, 24), (8, 16)):
+    for _ in range(_count):
+        P_CODES.append((_length, _code >> (8 - _length)))
+        _code += 1 << (8 - _length)
+
+# Decruncher state right after a reset: (ring mask, start location, the
+# location skipped after every track)
+QUICK_STATE = (0xFF, 251, 5)
+MEDIUM_STATE = (0x3FFF, 0x3FBE, 66)
+DEEP_STATE = (0x3FFF, 0x3FC4, 60)
+HEAVY1_STATE = (0x0FFF, 0, 0)
+HEAVY2_STATE = (0x1FFF, 0, 0)
+
+
+def crc16(data: bytes) -> int:
+    crc = 0
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+    return crc
+
+
+class BitWriter:
+    def __init__(self) -> None:
+        self.bits: List[int] = []
+
+    def put(self, count: int, value: int) -> None:
+        for shift in range(count - 1, -1, -1):
+            self.bits.append((value >> shift) & 1)
+
+    def bytes(self) -> bytes:
+        bits = self.bits + [0] * (-len(self.bits) % 8)
+        return bytes(
+            int("".join(map(str, bits[i : i + 8])), 2) for i in range(0, len(bits), 8)
+        )
+
+
+def packRle(data: bytes) -> bytes:
+    out = bytearray()
+    pos = 0
+
+    while pos < len(data):
+        byte = data[pos]
+        run = 1
+        while pos + run < len(data) and data[pos + run] == byte and run < 0xFFFF:
+            run += 1
+
+        if run >= 4 or (byte == 0x90 and run >= 2):
+            if run < 0xFF:
+                out += bytes([0x90, run, byte])
+            else:
+                out += bytes([0x90, 0xFF, byte, run >> 8, run & 0xFF])
+            pos += run
+        else:
+            out += b"\x90\x00" if byte == 0x90 else bytes([byte])
+            pos += 1
+
+    return bytes(out)
+
+
+class Dictionary:
+    """The decruncher's ring buffer, plus an index for finding matches.
+
+    Locations are kept as absolute numbers; only positions written since
+    the last reset are ever referenced.
+    """
+
+    def __init__(self, state: Tuple[int, int, int]) -> None:
+        self.mask, self.loc, self.skip = state
+        self.text = bytearray(self.mask + 1)
+        self.index: Dict[bytes, List[int]] = {}
+        self.floor = self.segment = self.loc
+
+    def write(self, byte: int) -> None:
+        self.text[self.loc & self.mask] = byte
+        self.loc += 1
+
+        start = self.loc - 3
+        if start >= self.segment:
+            key = bytes(self.text[(start + i) & self.mask] for i in range(3))
+            self.index.setdefault(key, []).append(start)
+
+    def endTrack(self) -> None:
+        self.loc += self.skip
+        self.segment = self.loc
+
+    def matchLength(self, data: bytes, pos: int, src: int, limit: int) -> int:
+        length = 0
+        while length < limit:
+            at = src + length
+            if at < self.loc:
+                byte = self.text[at & self.mask]
+            else:
+                byte = data[pos + at - self.loc]
+            if byte != data[pos + length]:
+                break
+            length += 1
+        return length
+
+    def find(
+        self, data: bytes, pos: int, min_len: int, max_len: int, max_offset: int
+    ) -> Optional[Tuple[int, int]]:
+        """Return the longest (length, offset) match at pos, if any."""
+        limit = min(max_len, len(data) - pos)
+        if limit < min_len:
+            return None
+
+        candidates = self.index.get(data[pos : pos + 3], [])
+        if min_len < 3:
+            # Short matches need no index, just try the nearby offsets
+            candidates = range(self.loc - 1, self.loc - 17, -1)
+        else:
+            candidates = reversed(candidates[-32:])
+
+        best = None
+        for src in candidates:
+            offset = self.loc - src - 1
+            # Positions before the last reset, or about to be overwritten
+            # during the copy, can't be referenced
+            if src < self.floor or offset > max_offset:
+                continue
+            if offset + max_len >= self.mask:
+                continue
+            length = self.matchLength(data, pos, src, limit)
+            if length >= min_len and (best is None or length > best[0]):
+                best = (length, offset)
+        return best
+
+    def copy(self, src: int, length: int) -> None:
+        for i in range(length):
+            self.write(self.text[(src + i) & self.mask])
+
+
+def putPosition(writer: BitWriter, offset: int) -> None:
+    length, code = P_CODES[offset >> 8]
+    writer.put(length, code)
+    writer.put(8, offset & 0xFF)
+
+
+def tokens(
+    dictionary: Dictionary,
+    data: bytes,
+    min_len: int,
+    max_len: int,
+    max_offset: int,
+) -> List[Tuple[int, int]]:
+    """Greedy parse into (literal, 0) and (length, offset) tokens.
+
+    Literals are marked with a length of 0.
+    """
+    result = []
+    pos = 0
+
+    while pos < len(data):
+        match = dictionary.find(data, pos, min_len, max_len, max_offset)
+        if match:
+            length, offset = match
+            dictionary.copy(dictionary.loc - offset - 1, length)
+            result.append((length, offset))
+            pos += length
+        else:
+            dictionary.write(data[pos])
+            result.append((0, data[pos]))
+            pos += 1
+
+    dictionary.endTrack()
+    return result
+
+
+def packQuick(dictionary: Dictionary, data: bytes) -> bytes:
+    writer = BitWriter()
+    for length, value in tokens(dictionary, data, 2, 5, 0xFF):
+        if length:
+            writer.put(1, 0)
+            writer.put(2, length - 2)
+            writer.put(8, value)
+        else:
+            writer.put(1, 1)
+            writer.put(8, value)
+    return writer.bytes()
+
+
+def packMedium(dictionary: Dictionary, data: bytes) -> bytes:
+    writer = BitWriter()
+    for length, value in tokens(dictionary, data, 3, 66, 0x3FFF):
+        if length:
+            writer.put(1, 0)
+            code_length, code = P_CODES[length - 3]
+            writer.put(code_length, code)
+            putPosition(writer, value)
+        else:
+            writer.put(1, 1)
+            writer.put(8, value)
+    return writer.bytes()
+
+
+class AdaptiveHuffman:
+    """The adaptive Huffman tree of LZHUF, as used by Deep."""
+
+    N_CHAR = 256 - 2 + 60
+    T = N_CHAR * 2 - 1
+    R = T - 1
+    MAX_FREQ = 0x8000
+
+    def __init__(self) -> None:
+        n_char, t = self.N_CHAR, self.T
+        self.freq = [0] * (t + 1)
+        self.son = [0] * t
+        self.prnt = [0] * (t + n_char)
+
+        for i in range(n_char):
+            self.freq[i] = 1
+            self.son[i] = i + t
+            self.prnt[i + t] = i
+
+        i, j = 0, n_char
+        while j <= self.R:
+            self.freq[j] = self.freq[i] + self.freq[i + 1]
+            self.son[j] = i
+            self.prnt[i] = self.prnt[i + 1] = j
+            i += 2
+            j += 1
+
+        self.freq[t] = 0xFFFF
+        self.prnt[self.R] = 0
+
+    def encode(self, writer: BitWriter, c: int) -> None:
+        path = []
+        k = self.prnt[c + self.T]
+        while k != self.R:
+            path.append(k & 1)
+            k = self.prnt[k]
+        for bit in reversed(path):
+            writer.put(1, bit)
+        self.update(c)
+
+    def reconst(self) -> None:
+        freq, son, prnt, t = self.freq, self.son, self.prnt, self.T
+
+        j = 0
+        for i in range(t):
+            if son[i] >= t:
+                freq[j] = (freq[i] + 1) // 2
+                son[j] = son[i]
+                j += 1
+
+        i = 0
+        for j in range(self.N_CHAR, t):
+            f = freq[i] + freq[i + 1]
+            k = j - 1
+            while f < freq[k]:
+                k -= 1
+            k += 1
+            freq.insert(k, f)
+            del freq[j + 1]
+            son.insert(k, i)
+            del son[j + 1]
+            i += 2
+
+        for i in range(t):
+            k = son[i]
+            prnt[k] = i
+            if k < t:
+                prnt[k + 1] = i
+
+    def update(self, c: int) -> None:
+        if self.freq[self.R] == self.MAX_FREQ:
+            self.reconst()
+
+        freq, son, prnt, t = self.freq, self.son, self.prnt, self.T
+        c = prnt[c + t]
+
+        # A do-while loop in LZHUF: the leaf may well sit at node 0
+        while True:
+            freq[c] += 1
+            k = freq[c]
+            if k > freq[c + 1]:
+                l = c + 1
+                while k > freq[l + 1]:
+                    l += 1
+                freq[c], freq[l] = freq[l], k
+
+                i = son[c]
+                prnt[i] = l
+                if i < t:
+                    prnt[i + 1] = l
+                j = son[l]
+                son[l] = i
+                prnt[j] = c
+                if j < t:
+                    prnt[j + 1] = c
+                son[c] = j
+                c = l
+            c = prnt[c]
+            if c == 0:
+                break
+
+
+def packDeep(dictionary: Dictionary, huffman: AdaptiveHuffman, data: bytes) -> bytes:
+    writer = BitWriter()
+    for length, value in tokens(dictionary, data, 3, 60, 0x3FFF):
+        if length:
+            huffman.encode(writer, length + 253)
+            putPosition(writer, value)
+        else:
+            huffman.encode(writer, value)
+    return writer.bytes()
+
+
+def huffmanLengths(freqs: Dict[int, int], max_length: int) -> Dict[int, int]:
+    """Code lengths of a complete Huffman code, at most max_length long."""
+    while True:
+        heap = [(freq, symbol, [symbol]) for symbol, freq in freqs.items()]
+        heapq.heapify(heap)
+        lengths = dict.fromkeys(freqs, 0)
+
+        while len(heap) > 1:
+            f1, s1, group1 = heapq.heappop(heap)
+            f2, _, group2 = heapq.heappop(heap)
+            for symbol in group1 + group2:
+                lengths[symbol] += 1
+            heapq.heappush(heap, (f1 + f2, s1, group1 + group2))
+
+        if max(lengths.values()) <= max_length:
+            return lengths
+        freqs = {symbol: (freq + 1) // 2 for symbol, freq in freqs.items()}
+
+
+def canonicalCodes(lengths: Dict[int, int]) -> Dict[int, Tuple[int, int]]:
+    """Assign codes in order of length, then symbol, as make_table expects."""
+    codes = {}
+    code = 0
+    previous = 0
+    for symbol, length in sorted(lengths.items(), key=lambda item: (item[1], item[0])):
+        code <<= length - previous
+        codes[symbol] = (length, code)
+        code += 1
+        previous = length
+    return codes
+
+
+class HeavyTables:
+    def __init__(self) -> None:
+        self.c: Optional[Dict[int, Tuple[int, int]]] = None
+        self.p: Optional[Dict[int, Tuple[int, int]]] = None
+
+
+def buildTable(
+    writer: BitWriter,
+    freqs: Dict[int, int],
+    count_bits: int,
+    length_bits: int,
+    max_length: int,
+) -> Dict[int, Tuple[int, int]]:
+    if len(freqs) == 1:
+        # A single symbol is sent on its own and then costs no bits
+        (symbol,) = freqs
+        writer.put(count_bits, 0)
+        writer.put(count_bits, symbol)
+        return {symbol: (0, 0)}
+
+    lengths = huffmanLengths(freqs, max_length)
+    writer.put(count_bits, max(lengths) + 1)
+    for symbol in range(max(lengths) + 1):
+        writer.put(length_bits, lengths.get(symbol, 0))
+    return canonicalCodes(lengths)
+
+
+def packHeavy(
+    dictionary: Dictionary,
+    tables: HeavyTables,
+    last_offset: List[int],
+    data: bytes,
+    np: int,
+) -> Tuple[bytes, bool]:
+    """Pack a track, returning the data and whether new tables were sent."""
+    parsed = tokens(dictionary, data, 3, 256, dictionary.mask - 256)
+
+    symbols = []
+    last = last_offset[0]
+    for length, value in parsed:
+        if not length:
+            symbols.append((value, None))
+            continue
+
+        if value == last:
+            position = (np - 1, 0, 0)
+        elif value == 0:
+            position = (0, 0, 0)
+        else:
+            bits = value.bit_length()
+            position = (bits, bits - 1, value - (1 << (bits - 1)))
+        last = value
+        symbols.append((length + 253, position))
+
+    c_freqs: Dict[int, int] = {}
+    p_freqs: Dict[int, int] = {}
+    for c, position in symbols:
+        c_freqs[c] = c_freqs.get(c, 0) + 1
+        if position:
+            p_freqs[position[0]] = p_freqs.get(position[0], 0) + 1
+    if not p_freqs:
+        p_freqs = {0: 1}
+
+    writer = BitWriter()
+    reuse = (
+        tables.c is not None
+        and all(c in tables.c for c in c_freqs)
+        and all(p in tables.p for p in p_freqs)
+    )
+    if not reuse:
+        tables.c = buildTable(writer, c_freqs, 9, 5, 16)
+        tables.p = buildTable(writer, p_freqs, 5, 4, 15)
+
+    for c, position in symbols:
+        writer.put(*tables.c[c])
+        if position:
+            symbol, extra_bits, extra = position
+            writer.put(*tables.p[symbol])
+            writer.put(extra_bits, extra)
+
+    last_offset[0] = last
+    return writer.bytes(), not reuse
+
+
+class Packer:
+    """Packs tracks in one mode, keeping decruncher state between them."""
+
+    def __init__(self, cmode: int) -> None:
+        self.cmode = cmode
+        self.tables = HeavyTables()
+        self.last_offset = [0]
+        self.reset()
+
+    def reset(self) -> None:
+        state = {
+            QUICK: QUICK_STATE,
+            MEDIUM: MEDIUM_STATE,
+            DEEP: DEEP_STATE,
+            HEAVY1: HEAVY1_STATE,
+            HEAVY2: HEAVY2_STATE,
+        }.get(self.cmode, QUICK_STATE)
+        self.dictionary = Dictionary(state)
+        self.huffman = AdaptiveHuffman()
+
+    def pack(self, data: bytes, keep_state: bool = True) -> Tuple[bytes, int, int]:
+        """Return the packed data, the length after the first stage and flags."""
+        flags = 1 if keep_state else 0
+
+        if self.cmode == NOCOMP:
+            packed, first = data, len(data)
+        elif self.cmode == RLE:
+            packed = packRle(data)
+            first = len(packed)
+        else:
+            rle = packRle(data)
+            first = len(rle)
+            if self.cmode == QUICK:
+                packed = packQuick(self.dictionary, rle)
+            elif self.cmode == MEDIUM:
+                packed = packMedium(self.dictionary, rle)
+            elif self.cmode == DEEP:
+                packed = packDeep(self.dictionary, self.huffman, rle)
+            else:
+                np = 14 if self.cmode == HEAVY1 else 15
+                packed, new_tables = packHeavy(
+                    self.dictionary, self.tables, self.last_offset, rle, np
+                )
+                flags |= 4 | (2 if new_tables else 0)
+
+        if not keep_state:
+            self.reset()
+
+        return packed, first, flags
+
+
+def trackRecord(
+    number: int, data: bytes, packed: bytes, first: int, flags: int, cmode: int
+) -> bytes:
+    header = struct.pack(
+        ">2sHHHHHBBHH",
+        b"TR",
+        number,
+        0,
+        len(packed),
+        first,
+        len(data),
+        flags,
+        cmode,
+        sum(data) & 0xFFFF,
+        crc16(packed),
+    )
+    return header + struct.pack(">H", crc16(header)) + packed
+
+
+def packImage(image: bytes, cmode: int, reset_every: int = 0) -> bytes:
+    """Pack a disk image into a DMS archive.
+
+    A banner, a fake 1024 byte bootblock and FILEID.DIZ are added. They are
+    packed on their own but flagged to keep the decruncher state, so only a
+    decoder that skips them, like xDMS does, gets the disk back.
+    """
+    header = bytearray(56)
+    header[:4] = b"DMS!"
+    struct.pack_into(">H", header, 54, crc16(bytes(header[4:54])))
+    out = bytearray(header)
+
+    extras = [
+        (0xFFFF, b"Packed for the adf-explorer tests\n" * 3),
+        (0, b"DOS\x00" + bytes(1020)),
+    ]
+    for number, data in extras:
+        packed, first, flags = Packer(cmode).pack(data)
+        out += trackRecord(number, data, packed, first, flags, cmode)
+
+    packer = Packer(cmode)
+    count = len(image) // TRACK_SIZE
+    for number in range(count):
+        data = image[number * TRACK_SIZE : (number + 1) * TRACK_SIZE]
+        keep = not reset_every or (number + 1) % reset_every != 0
+        packed, first, flags = packer.pack(data, keep)
+        out += trackRecord(number, data, packed, first, flags, cmode)
+
+    diz = b"Test disk\n"
+    out += trackRecord(80, diz, diz, len(diz), 0, NOCOMP)
+
+    return bytes(out)
+
+
+def makeImage() -> bytes:
+    """Build the known test disk: a few files on an otherwise empty volume."""
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from mastering import master
+
+    rng = random.Random(1985)
+    words = ["Amiga", "Workbench", "disk", "track", "block", "volume", "copper"]
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        readme = os.path.join(temp_dir, "README")
+        with open(readme, "w") as fh:
+            for line in range(300):
+                fh.write(" ".join(rng.choice(words) for _ in range(8)) + f" {line}\n")
+
+        noise = os.path.join(temp_dir, "noise.bin")
+        with open(noise, "wb") as fh:
+            fh.write(bytes(rng.randrange(256) for _ in range(3000)))
+
+        pattern = os.path.join(temp_dir, "pattern.bin")
+        with open(pattern, "wb") as fh:
+            fh.write(bytes(range(256)) * 24 + b"\x90" * 700 + bytes(300))
+
+        disk = {
+            "volume": "DMSTest",
+            "date": 500000000,
+            "files": [
+                {"source": readme, "path": "README"},
+                {"source": noise, "path": "noise.bin"},
+                {"source": pattern, "path": "pattern.bin"},
+            ],
+        }
+        path = os.path.join(temp_dir, "disk.adf")
+        master(disk, path)
+
+        with open(path, "rb") as fh:
+            return fh.read()
+
+
+def main() -> int:
+    directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+    os.makedirs(directory, exist_ok=True)
+
+    image = makeImage()
+    with open(os.path.join(directory, "disk.adz"), "wb") as fh:
+        fh.write(gzip.compress(image, mtime=0))
+
+    # Stored tracks are covered without a fixture, which would be as big as
+    # the disk itself
+    for name, cmode in MODES.items():
+        if cmode == NOCOMP:
+            continue
+        with open(os.path.join(directory, f"{name}.dms"), "wb") as fh:
+            fh.write(packImage(image, cmode, reset_every=30))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,28 @@
+from amitools.fs.ADFSVolume import ADFSVolume
+from amitools.fs.blkdev.BlkDevFactory import BlkDevFactory
+from amitools.tools.xdftool import make_fsstr
+
+from adf import ADF
+from image_cache import ImageCache
+
+
+def test_unparsable_archive_is_a_plain_file(tmp_path):
+    path = str(tmp_path / "disk.adf")
+    blkdev = BlkDevFactory().create(path)
+    volume = ADFSVolume(blkdev)
+    volume.create(make_fsstr("Test"))
+    volume.write_file(b"Not an archive", make_fsstr("/"), make_fsstr("notes.lha"))
+    volume.close()
+    blkdev.close()
+
+    adf = ADF(None, ImageCache(str(tmp_path / "cache")))
+    adf.attach(path, *adf.load(path))
+    adf.path = "/"
+
+    assert adf.listEntries(adf.volume.get_root_dir().get_entries_sorted_by_name()) == [
+        {"name": "notes.lha", "type": "archive"}
+    ]
+    assert not adf.isArchive("notes.lha")
+    assert adf.canWrite()
+    assert adf.extractToMemory("notes.lha") == "Not an archive"
+    adf.cleanUp()
@@ -0,0 +1,109 @@
+import gzip
+import io
+import os
+import random
+import struct
+
+import pytest
+
+import dms_packer
+from dms import DMS, DMSError
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+# The fixtures are made by dms_packer.py from the disk in disk.adz
+FIXTURES = ["rle", "quick", "medium", "deep", "heavy1", "heavy2"]
+
+
+@pytest.fixture(scope="module")
+def disk():
+    with gzip.open(os.path.join(DATA, "disk.adz"), "rb") as fh:
+        return fh.read()
+
+
+def unpack(archive):
+    return DMS().unpack(io.BytesIO(archive))
+
+
+@pytest.mark.parametrize("name", FIXTURES)
+def test_fixture_unpacks_to_known_disk(disk, name):
+    with open(os.path.join(DATA, name + ".dms"), "rb") as fh:
+        tracks = list(DMS().tracks(fh))
+
+    assert len(tracks) == 80
+    assert b"".join(tracks) == disk
+
+
+@pytest.mark.parametrize("name", sorted(dms_packer.MODES))
+def test_round_trip(name):
+    # Random text with long runs and repeats, over several tracks so the
+    # decruncher state and the rebuild of Deep's tree are exercised
+    rng = random.Random(name)
+    image = bytearray()
+    while len(image) < 8 * dms_packer.TRACK_SIZE:
+        choice = rng.random()
+        if choice < 0.05:
+            image += bytes([rng.randrange(256)]) * rng.randrange(4, 300)
+        elif choice < 0.2 and len(image) > 300:
+            start = rng.randrange(len(image) - 300)
+            image += image[start : start + rng.randrange(3, 300)]
+        else:
+            image += bytes(rng.randrange(256) for _ in range(rng.randrange(1, 40)))
+    image = bytes(image[: 8 * dms_packer.TRACK_SIZE])
+
+    cmode = dms_packer.MODES[name]
+    assert unpack(dms_packer.packImage(image, cmode, reset_every=0)) == image
+
+
+def test_not_a_dms_archive():
+    with pytest.raises(DMSError, match="Not a DMS"):
+        unpack(b"ADF!" + bytes(52))
+
+
+def test_corrupt_header():
+    archive = bytearray(dms_packer.packImage(bytes(dms_packer.TRACK_SIZE), 1))
+    archive[20] ^= 1
+
+    with pytest.raises(DMSError, match="header is corrupt"):
+        unpack(bytes(archive))
+
+
+def test_encrypted_archive():
+    header = bytearray(56)
+    header[:4] = b"DMS!"
+    struct.pack_into(">H", header, 10, 2)
+    struct.pack_into(">H", header, 54, dms_packer.crc16(bytes(header[4:54])))
+
+    with pytest.raises(DMSError, match="Encrypted"):
+        unpack(bytes(header))
+
+
+def test_corrupt_track_data():
+    archive = bytearray(dms_packer.packImage(bytes(dms_packer.TRACK_SIZE), 1))
+    archive[-1 - 20 - 10] ^= 1
+
+    with pytest.raises(DMSError, match="Track 0 data is corrupt"):
+        unpack(bytes(archive))
+
+
+def test_checksum_mismatch():
+    data = bytes(dms_packer.TRACK_SIZE)
+    packed = dms_packer.packRle(data)
+    record = bytearray(dms_packer.trackRecord(0, data, packed, len(packed), 0, 1))
+    struct.pack_into(">H", record, 14, 1)
+    struct.pack_into(">H", record, 18, dms_packer.crc16(bytes(record[:18])))
+
+    archive = dms_packer.packImage(b"", 1)
+
+    with pytest.raises(DMSError, match="Track 0 checksum mismatch"):
+        unpack(archive + bytes(record))
+
+
+def test_unknown_compression_mode():
+    data = bytes(dms_packer.TRACK_SIZE)
+    archive = dms_packer.packImage(b"", 1) + dms_packer.trackRecord(
+        0, data, data, len(data), 0, 7
+    )
+
+    with pytest.raises(DMSError, match="Unknown DMS compression mode 7"):
+        unpack(archive)
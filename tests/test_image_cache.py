@@ -0,0 +1,93 @@
+import os
+import shutil
+
+import image_cache
+from image_cache import ImageCache
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+
+def age(cache, key, mtime):
+    os.utime(cache.entryPath(key), (mtime, mtime))
+
+
+def test_load_unpacks_once_and_then_hits(tmp_path, monkeypatch):
+    calls = []
+    decompress = image_cache.decompressImage
+
+    def counting(path):
+        calls.append(path)
+        return decompress(path)
+
+    monkeypatch.setattr(image_cache, "decompressImage", counting)
+    cache = ImageCache(str(tmp_path / "cache"))
+    path = os.path.join(DATA, "heavy2.dms")
+
+    first = cache.load(path)
+    second = cache.load(path)
+
+    assert len(first) == 901120
+    assert second == first
+    assert calls == [path]
+    assert cache.load(os.path.join(DATA, "disk.adz")) == first
+    assert len(cache.entries()) == 2
+
+
+def test_cache_key_follows_content(tmp_path):
+    cache = ImageCache(str(tmp_path / "cache"))
+    path = str(tmp_path / "disk.adz")
+    shutil.copy(os.path.join(DATA, "disk.adz"), path)
+    cache.load(path)
+
+    # A renamed copy still hits, changed content misses
+    os.rename(path, str(tmp_path / "renamed.adz"))
+    assert cache.get(cache.key(str(tmp_path / "renamed.adz"))) is not None
+
+    with open(str(tmp_path / "renamed.adz"), "ab") as fh:
+        fh.write(b"\0")
+    assert cache.get(cache.key(str(tmp_path / "renamed.adz"))) is None
+
+
+def test_hit_marks_entry_as_recently_used(tmp_path):
+    cache = ImageCache(str(tmp_path), maxSize=300)
+    cache.put("a", b"a" * 100)
+    age(cache, "a", 1000)
+
+    assert cache.get("a") == b"a" * 100
+    assert os.stat(cache.entryPath("a")).st_mtime > 1000
+    assert cache.get("missing") is None
+
+
+def test_evicts_least_recently_used_past_max_size(tmp_path):
+    cache = ImageCache(str(tmp_path), maxSize=300)
+    for mtime, key in enumerate("abc"):
+        cache.put(key, key.encode() * 100)
+        age(cache, key, 1000 + mtime)
+
+    # Reading "a" makes "b" the oldest entry
+    cache.get("a")
+    cache.put("d", b"d" * 100)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == b"a" * 100
+    assert cache.get("c") == b"c" * 100
+    assert cache.get("d") == b"d" * 100
+
+
+def test_does_not_cache_images_larger_than_max_size(tmp_path):
+    cache = ImageCache(str(tmp_path), maxSize=300)
+    cache.put("a", b"a" * 100)
+    cache.put("big", b"x" * 301)
+
+    assert cache.get("big") is None
+    assert cache.get("a") == b"a" * 100
+
+
+def test_clear(tmp_path):
+    cache = ImageCache(str(tmp_path), maxSize=300)
+    cache.put("a", b"a" * 100)
+    (tmp_path / "other.txt").write_text("kept")
+    cache.clear()
+
+    assert cache.entries() == []
+    assert (tmp_path / "other.txt").exists()
@@ -0,0 +1,110 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from amitools.fs.ADFSVolume import ADFSVolume
+from amitools.fs.blkdev.BlkDevFactory import BlkDevFactory
+from amitools.tools.xdftool import make_fsstr
+
+from mastering import build, loadManifest, main
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def writeManifest(tmp_path, **disk):
+    build_dir = tmp_path / "build"
+    (build_dir / "c").mkdir(parents=True)
+    (build_dir / "c" / "run").write_bytes(bytes(range(256)) * 20)
+    (build_dir / "README").write_text("Hello")
+
+    manifest = tmp_path / "disk.json"
+    manifest.write_text(
+        json.dumps(
+            dict(
+                {
+                    "output": "out/disk.adf",
+                    "volume": "Disk",
+                    "files": [
+                        {"source": "build/c", "path": "C", "protect": "rwed"},
+                        {
+                            "source": "build/README",
+                            "path": "README",
+                            "comment": "Read me",
+                        },
+                    ],
+                },
+                **disk,
+            )
+        )
+    )
+    return str(manifest)
+
+
+def buildImage(manifest, env=None):
+    subprocess.run(
+        [sys.executable, os.path.join(ROOT, "mastering.py"), "--force", manifest],
+        check=True,
+        env=dict(os.environ, **(env or {})),
+    )
+    with open(loadManifest(manifest)[0]["output"], "rb") as fh:
+        return fh.read()
+
+
+def test_same_manifest_builds_same_bytes(tmp_path):
+    manifest = writeManifest(tmp_path, date=1000000000)
+
+    first = buildImage(manifest, {"TZ": "America/New_York"})
+    second = buildImage(manifest, {"TZ": "Asia/Tokyo"})
+
+    assert first == second
+
+
+def test_built_image_has_files_and_dates(tmp_path):
+    manifest = writeManifest(tmp_path)
+    buildImage(manifest)
+
+    blkdev = BlkDevFactory().open(str(tmp_path / "out" / "disk.adf"))
+    volume = ADFSVolume(blkdev)
+    volume.open()
+    try:
+        readme = volume.get_path_name(make_fsstr("README"))
+        run = volume.get_path_name(make_fsstr("C/run"))
+
+        assert readme.get_file_data() == b"Hello"
+        assert str(readme.get_meta_info().get_comment()) == "Read me"
+        assert run.get_file_data() == bytes(range(256)) * 20
+        assert volume.get_meta_info().get_create_ts().get_secs() == 0
+        assert readme.get_meta_info().get_mod_ts().get_secs() == 0
+    finally:
+        volume.close()
+        blkdev.close()
+
+
+def test_date_before_amiga_epoch_fails(tmp_path):
+    manifest = writeManifest(tmp_path, date=0)
+    output, status = build(loadManifest(manifest)[0])
+
+    assert status.startswith("failed")
+    assert not os.path.exists(output)
+
+
+def test_new_empty_directory_triggers_rebuild(tmp_path):
+    manifest = writeManifest(tmp_path)
+    disk = loadManifest(manifest)[0]
+
+    assert build(disk) == (disk["output"], "built")
+    assert build(disk) == (disk["output"], "skipped")
+
+    (tmp_path / "build" / "c" / "empty").mkdir()
+    assert build(disk) == (disk["output"], "built")
+
+
+def test_jobs_must_be_positive(tmp_path):
+    manifest = writeManifest(tmp_path)
+
+    with pytest.raises(SystemExit) as e:
+        main(["-j", "0", manifest])
+    assert e.value.code == 2
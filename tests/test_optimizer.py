@@ -0,0 +1,119 @@
+import os
+
+import pytest
+
+from amitools.fs.ADFSVolume import ADFSVolume
+from amitools.fs.blkdev.BlkDevFactory import BlkDevFactory
+from amitools.fs.FSError import FSError
+from amitools.fs.MetaInfo import MetaInfo
+from amitools.fs.RootMetaInfo import RootMetaInfo
+from amitools.fs.TimeStamp import TimeStamp
+from amitools.tools.xdftool import make_fsstr
+
+from optimizer import Optimizer
+
+
+def makeFragmentedImage(path):
+    blkdev = BlkDevFactory().create(path)
+    volume = ADFSVolume(blkdev)
+    volume.create(make_fsstr("Test"))
+
+    meta = MetaInfo(protect=0, comment=make_fsstr("All the games"))
+    meta.set_current_as_mod_time()
+    volume.get_root_dir().create_dir(make_fsstr("Games"), meta)
+    volume.create_dir(make_fsstr("Games/Saves"))
+
+    for name in ("gap", "one", "two"):
+        volume.write_file(
+            name.encode() * 2000, make_fsstr("Games/Saves"), make_fsstr(name)
+        )
+    volume.delete(make_fsstr("Games/Saves/gap"))
+
+    volume.close()
+    blkdev.close()
+
+    # A fresh volume fills the gap first, then continues after the last file
+    blkdev = BlkDevFactory().open(path, options={"type": "adf"})
+    volume = ADFSVolume(blkdev)
+    volume.open()
+    volume.write_file(os.urandom(60000), make_fsstr("Games/Saves"), make_fsstr("big"))
+
+    volume.get_path_name(make_fsstr("Games/Saves")).change_meta_info(
+        MetaInfo(mod_ts=TimeStamp(days=5000, mins=600))
+    )
+    volume.change_meta_info(
+        RootMetaInfo(
+            create_ts=TimeStamp(days=10),
+            disk_ts=TimeStamp(days=20),
+            mod_ts=TimeStamp(days=30),
+        )
+    )
+
+    volume.close()
+    blkdev.close()
+
+
+def openImage(path):
+    blkdev = BlkDevFactory().open(path, options={"type": "adf"})
+    volume = ADFSVolume(blkdev)
+    volume.open()
+    return blkdev, volume
+
+
+def test_rebuild_keeps_nested_directories(tmp_path):
+    source = str(tmp_path / "source.adf")
+    # Without the .adf extension, as typed into the save dialog
+    output = str(tmp_path / "output")
+    makeFragmentedImage(source)
+
+    blkdev, volume = openImage(source)
+    original = volume.get_path_name(make_fsstr("Games/Saves/big")).get_file_data()
+    before, after = Optimizer(volume, blkdev).rebuild(output)
+    volume.close()
+    blkdev.close()
+
+    assert before > 0
+    assert after == 0
+
+    blkdev, volume = openImage(output)
+    try:
+        games = volume.get_path_name(make_fsstr("Games"))
+        saves = volume.get_path_name(make_fsstr("Games/Saves"))
+
+        root = volume.get_meta_info()
+        dates = (root.get_create_ts(), root.get_disk_ts(), root.get_mod_ts())
+        assert [date.days for date in dates] == [10, 20, 30]
+        assert str(games.get_meta_info().get_comment()) == "All the games"
+        date = saves.get_meta_info().get_mod_ts()
+        assert (date.days, date.mins) == (5000, 600)
+        assert (
+            volume.get_path_name(make_fsstr("Games/Saves/big")).get_file_data()
+            == original
+        )
+        assert (
+            volume.get_path_name(make_fsstr("Games/Saves/one")).get_file_data()
+            == b"one" * 2000
+        )
+    finally:
+        volume.close()
+        blkdev.close()
+
+
+def test_rebuild_removes_output_on_failure(tmp_path):
+    source = str(tmp_path / "source.adf")
+    output = str(tmp_path / "output.adf")
+    makeFragmentedImage(source)
+
+    blkdev, volume = openImage(source)
+    try:
+        # Break a data block, so reading the file fails halfway through
+        node = volume.get_path_name(make_fsstr("Games/Saves/one"))
+        blkdev.write_block(node.data_blk_nums[0], bytes(blkdev.block_bytes))
+
+        with pytest.raises(FSError):
+            Optimizer(volume, blkdev).rebuild(output)
+    finally:
+        volume.close()
+        blkdev.close()
+
+    assert not os.path.exists(output)
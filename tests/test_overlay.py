@@ -0,0 +1,155 @@
+import os
+
+import pytest
+from amitools.fs.blkdev.BlkDevFactory import BlkDevFactory
+
+from overlay import Journal, JournalError, OverlayBlockDevice
+
+BLOCK_BYTES = 512
+BLOCKS = 1760
+
+
+def block(value):
+    return bytes([value]) * BLOCK_BYTES
+
+
+@pytest.fixture
+def image(tmp_path):
+    path = str(tmp_path / "disk.adf")
+    with open(path, "wb") as fh:
+        for blk_num in range(BLOCKS):
+            fh.write(block(blk_num % 256))
+    return path
+
+
+@pytest.fixture
+def overlay(image):
+    device = OverlayBlockDevice(BlkDevFactory().open(image, read_only=True))
+    yield device
+    device.close()
+
+
+def readImageBlock(path, blk_num):
+    with open(path, "rb") as fh:
+        fh.seek(blk_num * BLOCK_BYTES)
+        return fh.read(BLOCK_BYTES)
+
+
+def test_writes_shadow_the_base_until_saved(image, overlay):
+    overlay.begin("Write")
+    overlay.write_block(5, block(0xAA))
+    overlay.commit()
+
+    assert overlay.read_block(5) == block(0xAA)
+    assert overlay.read_block(4, 3) == block(4) + block(0xAA) + block(6)
+    assert overlay.isDirty()
+    assert overlay.dirtyBlocks() == {5: block(0xAA)}
+    assert readImageBlock(image, 5) == block(5)
+
+
+def test_undo_restores_each_transaction(overlay):
+    overlay.begin("First")
+    overlay.write_block(5, block(1))
+    overlay.commit()
+    overlay.begin("Second")
+    overlay.write_block(5, block(2))
+    overlay.write_block(5, block(3))
+    overlay.write_block(6, block(4), 1)
+    overlay.commit()
+
+    assert overlay.undoLabel() == "Second"
+    assert overlay.undo() == "Second"
+    assert overlay.read_block(5) == block(1)
+    assert overlay.read_block(6) == block(6)
+
+    assert overlay.undo() == "First"
+    assert overlay.read_block(5) == block(5)
+    assert not overlay.isDirty()
+    assert overlay.undo() is None
+    assert overlay.undoLabel() is None
+
+
+def test_rollback_drops_uncommitted_writes(overlay):
+    overlay.begin("Kept")
+    overlay.write_block(5, block(1))
+    overlay.commit()
+
+    overlay.begin("Failed")
+    overlay.write_block(5, block(2))
+    overlay.write_block(7, block(3))
+    overlay.rollback()
+
+    assert overlay.read_block(5) == block(1)
+    assert overlay.read_block(7) == block(7)
+    assert overlay.undoLabel() == "Kept"
+
+
+def test_undo_stack_is_bounded(image):
+    overlay = OverlayBlockDevice(BlkDevFactory().open(image, read_only=True), 2)
+    for i in range(3):
+        overlay.begin(f"Write {i}")
+        overlay.write_block(i, block(0xFF))
+        overlay.commit()
+
+    assert overlay.undo() == "Write 2"
+    assert overlay.undo() == "Write 1"
+    assert overlay.undo() is None
+    assert overlay.read_block(0) == block(0xFF)
+    overlay.close()
+
+
+def test_discard_forgets_all_changes(overlay):
+    overlay.begin("Write")
+    overlay.write_block(5, block(1))
+    overlay.commit()
+    overlay.discard()
+
+    assert overlay.read_block(5) == block(5)
+    assert not overlay.isDirty()
+    assert overlay.undoLabel() is None
+
+
+def test_journal_write_and_apply(image):
+    journal = Journal(image)
+    journal.write({3: block(0xAA), 1000: block(0xBB)}, BLOCK_BYTES)
+
+    assert journal.pending()
+    assert readImageBlock(image, 3) == block(3)
+
+    journal.apply()
+
+    assert not journal.pending()
+    assert readImageBlock(image, 3) == block(0xAA)
+    assert readImageBlock(image, 1000) == block(0xBB)
+    assert readImageBlock(image, 4) == block(4)
+
+
+def test_recover_applies_a_complete_journal(image):
+    Journal(image).write({3: block(0xAA)}, BLOCK_BYTES)
+
+    # As left behind by a save interrupted after the rename
+    assert Journal(image).recover()
+    assert readImageBlock(image, 3) == block(0xAA)
+    assert not Journal(image).pending()
+    assert not Journal(image).recover()
+
+
+@pytest.mark.parametrize("damage", ["truncate", "checksum"])
+def test_recover_removes_a_broken_journal(image, damage):
+    journal = Journal(image)
+    journal.write({3: block(0xAA), 4: block(0xBB)}, BLOCK_BYTES)
+
+    with open(journal.path, "r+b") as fh:
+        if damage == "truncate":
+            fh.truncate(os.path.getsize(journal.path) - 100)
+        else:
+            fh.seek(20)
+            fh.write(b"\x00")
+
+    with pytest.raises(JournalError):
+        journal.read()
+
+    assert not journal.recover()
+    assert not journal.pending()
+    assert readImageBlock(image, 3) == block(3)
+    assert readImageBlock(image, 4) == block(4)
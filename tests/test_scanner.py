@@ -0,0 +1,9 @@
+import pytest
+
+from scanner import main
+
+
+def test_jobs_must_be_positive(tmp_path):
+    with pytest.raises(SystemExit) as e:
+        main(["-j", "0", str(tmp_path)])
+    assert e.value.code == 2
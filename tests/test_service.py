@@ -0,0 +1,108 @@
+import asyncio
+import os
+
+import pytest
+from amitools.fs.ADFSVolume import ADFSVolume
+from amitools.fs.blkdev.BlkDevFactory import BlkDevFactory
+from amitools.fs.DosType import DOS0, DOS1
+from amitools.fs.MetaInfo import MetaInfo
+from amitools.tools.xdftool import make_fsstr
+
+from adf import ADF
+from image_cache import ImageCache
+from service import INVALID_REQUEST, Service, Stats, VolumeHandle, VolumePool
+
+DATA = os.urandom(70000)
+
+
+@pytest.fixture(params=[DOS0, DOS1], ids=["ofs", "ffs"])
+def handle(request, tmp_path):
+    path = str(tmp_path / "disk.adf")
+    blkdev = BlkDevFactory().create(path)
+    volume = ADFSVolume(blkdev)
+    volume.create(make_fsstr("Test"), dos_type=request.param)
+    volume.create_dir(make_fsstr("Dir"))
+
+    meta = MetaInfo(protect=0x0F, comment=make_fsstr("Keep me"))
+    meta.set_current_as_mod_time()
+    volume.get_path_name(make_fsstr("Dir")).create_file(make_fsstr("file"), DATA, meta)
+    volume.close()
+    blkdev.close()
+
+    loader = ADF(None, ImageCache(str(tmp_path / "cache")))
+    handle = VolumeHandle(path, *loader.load(path))
+    yield handle
+    handle.close()
+
+
+@pytest.mark.parametrize(
+    "offset, length",
+    [(0, None), (0, 10), (480, 40), (1000, 20000), (69990, 100), (70000, 5)],
+)
+def test_read_returns_range(handle, offset, length):
+    end = None if length is None else offset + length
+    assert handle.read("Dir/file", offset, length) == DATA[offset:end]
+
+
+def test_write_keeps_protection_and_comment(handle):
+    handle.write("Dir/file", b"new data")
+
+    node = handle.node("Dir/file")
+    meta = node.get_meta_info()
+
+    assert handle.read("Dir/file") == b"new data"
+    assert meta.get_protect() == 0x0F
+    assert str(meta.get_comment()) == "Keep me"
+
+
+def makeImage(path):
+    blkdev = BlkDevFactory().create(path)
+    volume = ADFSVolume(blkdev)
+    volume.create(make_fsstr("Test"))
+    volume.close()
+    blkdev.close()
+
+
+def test_pool_keeps_new_handle_while_others_are_busy(tmp_path):
+    first = str(tmp_path / "first.adf")
+    second = str(tmp_path / "second.adf")
+    makeImage(first)
+    makeImage(second)
+
+    async def run():
+        stats = Stats()
+        pool = VolumePool(stats, maxHandles=1)
+        busy = await pool.acquire(first)
+
+        async with busy.lock:
+            handle = await pool.acquire(second)
+            assert not handle.closed
+            assert len(pool.handles) == 2
+
+        # Over the limit only until the next handle is opened
+        await pool.acquire(second)
+        await pool.trim(keep=second)
+        assert list(pool.handles) == [second]
+        counts = (stats.misses, stats.evictions)
+        await pool.closeAll()
+        return counts
+
+    assert asyncio.run(run()) == (2, 1)
+
+
+def test_dispatch_rejects_invalid_method_and_ignores_notifications():
+    async def run():
+        stats = Stats()
+        service = Service(VolumePool(stats), stats)
+        invalid = await service.dispatch({"jsonrpc": "2.0", "id": 9, "method": ["x"]})
+        unknown = await service.dispatch({"jsonrpc": "2.0", "method": "nothing"})
+        failed = await service.dispatch(
+            {"jsonrpc": "2.0", "method": "read", "params": {"image": "missing.adf"}}
+        )
+        service.pool.executor.shutdown()
+        return invalid, unknown, failed
+
+    invalid, unknown, failed = asyncio.run(run())
+    assert invalid["error"]["code"] == INVALID_REQUEST
+    assert unknown is None
+    assert failed is None
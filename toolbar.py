@@ -12,6 +12,8 @@ class Toolbar():
 
         self.toolbar.addAction(app.app_actions.createAction)
         self.toolbar.addAction(app.app_actions.openAction)
+        self.toolbar.addAction(app.app_actions.saveAction)
+        self.toolbar.addAction(app.app_actions.undoAction)
         self.toolbar.addAction(app.app_actions.relabelAction)
         self.toolbar.addAction(app.app_actions.makeDirAction)
         self.toolbar.addAction(app.app_actions.parentAction)